@@ -0,0 +1,67 @@
+'''Compare the in-process converters to PDF with the LibreOffice round trip.
+
+Usage: python -m benchmarks.converters [--repeat 5]
+'''
+import argparse
+import shutil
+import time
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+
+from PIL import Image
+
+from src.converters import converters, convert_with_unoconv
+
+
+def sample_files() -> dict:
+    '''Return sample file contents for every MIME type with a fast path.'''
+    photo = BytesIO()
+    Image.effect_mandelbrot((4000, 3000), (-2, -1.5, 1, 1.5), 100).convert('RGB').save(
+        photo, 'JPEG', quality=90,
+    )
+    screenshot = BytesIO()
+    Image.linear_gradient('L').resize((1920, 1080)).convert('RGB').save(screenshot, 'PNG')
+    text = ''.join(f'{idx:5}  The quick brown fox jumps over the lazy dog.\n'
+                   for idx in range(3000))
+    return {
+        'image/jpeg': ('.jpg', photo.getvalue()),
+        'image/png': ('.png', screenshot.getvalue()),
+        'text/plain': ('.txt', text.encode()),
+    }
+
+
+def measure(function, file, repeat: int) -> float:
+    '''Return the best time of converting the file, in seconds.'''
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function(file)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def main():
+    '''Time the in-process converters, and unoconv if it is installed.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    has_unoconv = shutil.which('unoconv') is not None
+
+    for mime, (suffix, content) in sample_files().items():
+        with NamedTemporaryFile(suffix=suffix) as file:
+            file.write(content)
+            file.flush()
+
+            fast = measure(converters[mime], file, args.repeat)
+            line = f'{mime:>12}: in-process {fast * 1000:8.1f} ms'
+            if has_unoconv:
+                slow = measure(convert_with_unoconv, file, args.repeat)
+                line += f', unoconv {slow * 1000:8.1f} ms, saved {(slow - fast) * 1000:8.1f} ms'
+            print(line)
+
+    if not has_unoconv:
+        print('unoconv is not installed, only the in-process timings are shown')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''Measure the memory that print jobs take while they wait to be printed or expire,
+along with the time to restore them from records and to write the records back.
+
+The jobs are restored from synthetic records, which share a single spool file.
+
+Usage: python -m benchmarks.jobs [--jobs 10000]
+'''
+import argparse
+import gc
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from tempfile import TemporaryDirectory
+
+SPOOL = TemporaryDirectory(prefix='benchmark-spool-')  # pylint: disable=consider-using-with
+os.environ.setdefault('CUPS_FAKE', '1')
+os.environ.setdefault('SPOOL_DIR', SPOOL.name)
+
+# pylint: disable=wrong-import-position
+from src.print_job import PrintJob
+
+from .pages import spool, synthetic_pdf
+
+
+def synthetic_record(idx: int, spool_path: str) -> dict:
+    '''Return the record of a typical job: a few page ranges, sometimes a caption.'''
+    total = 5 + idx % 40
+    return {
+        'id': f'{idx:032x}',
+        'user_id': 1000 + idx % 300,
+        'state': PrintJob.STATE_PREPARING,
+        'spool_path': spool_path,
+        'original_name': f'document {idx}.pdf',
+        'converted': idx % 3 == 0,
+        'copies': 1,
+        'total': total,
+        'selection': [[0, 2], [3, total]],
+        'per_page': 1,
+        'quality': 'normal',
+        'duplex': True,
+        'portrait': True,
+        'mixed_orientation': False,
+        'printer': None,
+        'job_indices': [],
+        'streaming': False,
+        'chat_id': 1000 + idx % 300,
+        'message_id': idx,
+        'created_at': datetime.now().isoformat(),
+        'potential_page_ranges': [['1', '3']] if idx % 5 == 0 else [],
+        'content_hash': None,
+        'preview_file_id': None,
+        'size_before_optimization': None,
+        'size_after_optimization': None,
+        'submitted_at': None,
+    }
+
+
+def main():
+    '''Measure the memory and time it takes to restore and record the jobs.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=10000)
+    args = parser.parse_args()
+
+    container = spool(synthetic_pdf(10))
+    container.close()
+    records = [synthetic_record(idx, container.name) for idx in range(args.jobs)]
+
+    gc.collect()
+    tracemalloc.start()
+    before, _peak = tracemalloc.get_traced_memory()
+    started_at = time.perf_counter()
+    jobs = [PrintJob.from_record(record) for record in records]
+    restored_in = time.perf_counter() - started_at
+    gc.collect()
+    after, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started_at = time.perf_counter()
+    for job in jobs:
+        job.to_record()
+    recorded_in = time.perf_counter() - started_at
+
+    print(f'{len(jobs)} jobs: {(after - before) / len(jobs):.0f} bytes per job, '
+          f'{(after - before) / 1024 / 1024:.1f} MiB in total')
+    print(f'Restoring: {restored_in / len(jobs) * 1e6:.1f} µs per job, '
+          f'writing the record: {recorded_in / len(jobs) * 1e6:.1f} µs per job')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+'''Load-test the bot in-process with a fake Telegram and simulated printers.
+
+Every session is a user going through upload → pages → copies → print,
+with the updates fed to the dispatcher the way the updater does.
+
+Usage: python -m benchmarks.load [--sessions 100] [--rate 5] [--pages 20]
+                                 [--pages-per-minute 600] [--think 0.1] [--latency 0.05]
+'''
+import argparse
+import json
+import os
+import resource
+import time
+from itertools import count
+from tempfile import TemporaryDirectory
+from threading import Event, Lock, Thread
+from typing import Dict, List
+
+from PyPDF4 import PdfFileWriter
+from telegram import Update
+
+AUTH_TOKEN = 'load-test'
+PAGE_SIZE = (595, 842)
+
+
+def quantile(values: List[float], fraction: float) -> float:
+    '''Return the quantile of the measurements.'''
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def write_document(path: str, pages: int):
+    '''Write a PDF with blank pages for the sessions to print.'''
+    writer = PdfFileWriter()
+    for _ in range(pages):
+        writer.addBlankPage(*PAGE_SIZE)
+    with open(path, 'wb') as file:
+        writer.write(file)
+
+
+def setup_environment(directory: str, pages_per_minute: float):
+    '''Point the bot to the simulated printers and keep its state in the directory.'''
+    os.environ.update({
+        'CUPS_FAKE': '1',
+        'CUPS_FAKE_PAGES_PER_MINUTE': str(pages_per_minute),
+        'BOT_API_TOKEN': '123456:fake',
+        'AUTH_TOKEN': AUTH_TOKEN,
+        'PERSISTENCE_DB': os.path.join(directory, 'data.sqlite3'),
+        'JOB_STORE_DB': os.path.join(directory, 'jobs.sqlite3'),
+        'SPOOL_DIR': os.path.join(directory, 'spool'),
+    })
+
+
+def start_bot(telegram):
+    '''Import the bot, connect it to the fake Telegram and start handling updates.
+       The environment must be set up before.'''
+    # pylint: disable=import-outside-toplevel
+    from telegram import Bot
+
+    from src.main import updater
+    from src.print_job import PrintJob
+
+    updater.bot = updater.dispatcher.bot = PrintJob.bot = Bot('123456:fake', request=telegram)
+    updater.job_queue.start()
+    Thread(target=updater.dispatcher.start, daemon=True).start()
+    return updater
+
+
+def stop_bot(updater):
+    '''Stop handling updates and running jobs.'''
+    updater.dispatcher.stop()
+    updater.job_queue.stop()
+
+
+def add_simulation_arguments(parser: argparse.ArgumentParser):
+    '''Add the options of the simulated printers and Telegram.'''
+    parser.add_argument('--pages-per-minute', type=float, default=600,
+                        help='the speed of each simulated printer')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds every Telegram call takes')
+    parser.add_argument('--drain', type=float, default=60,
+                        help='seconds to wait for the printers to finish at most')
+
+
+def signal_handled(dispatcher, events: Dict[int, Event], lock: Lock):
+    '''Make the dispatcher set the event of every update in `events` once it's handled.'''
+    process_update = dispatcher.process_update
+
+    def signalling(update):
+        try:
+            process_update(update)
+        finally:
+            with lock:
+                event = events.pop(getattr(update, 'update_id', None), None)
+            if event is not None:
+                event.set()
+
+    dispatcher.process_update = signalling
+
+
+def drain(timeout: float) -> float:
+    '''Wait until the printers have finished all the jobs, or for `timeout` seconds at most,
+       and return how long it took.'''
+    # pylint: disable=import-outside-toplevel
+    from src.cups_server import fake_server
+    from src.scheduler import scheduler
+
+    started_at = time.monotonic()
+    while ((scheduler.held() or scheduler.starting() or fake_server.getJobs())
+           and time.monotonic() - started_at < timeout):
+        time.sleep(0.5)
+    return time.monotonic() - started_at
+
+
+def print_rss_growth(rss_before: int):
+    '''Report how much the peak memory use grew since it was `rss_before` KiB.'''
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'Peak RSS grew by {(rss_after - rss_before) / 1024:.1f} MB '
+          f'to {rss_after / 1024:.1f} MB')
+
+
+class Harness:
+    '''Feeds scripted sessions to the dispatcher and measures how it copes.'''
+
+    def __init__(self, updater, telegram, think: float):
+        self.updater = updater
+        self.telegram = telegram
+        self.think = think
+        self.update_ids = count(1)
+        self.pending: Dict[int, Event] = {}
+        self.latencies: Dict[str, List[float]] = {}
+        self.lock = Lock()
+        signal_handled(updater.dispatcher, self.pending, self.lock)
+
+    def send(self, step: str, payload: dict, reply_from: int = None):
+        '''Put an update into the dispatcher's queue and wait until it's handled,
+           or until the bot replies with a keyboard to `reply_from` if that's given.'''
+        update_id = next(self.update_ids)
+        event = Event()
+        with self.lock:
+            self.pending[update_id] = event
+        update = Update.de_json(dict(payload, update_id=update_id), self.updater.bot)
+
+        started_at = time.monotonic()
+        self.updater.dispatcher.update_queue.put(update)
+        if not event.wait(timeout=60):
+            raise TimeoutError(f'Update {update_id} ({step}) was not handled')
+        # Documents are processed by the conversion workers after the handler returns
+        deadline = started_at + 60
+        while reply_from is not None and reply_from not in self.telegram.markups:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'No reply to update {update_id} ({step})')
+            time.sleep(0.005)
+        with self.lock:
+            self.latencies.setdefault(step, []).append(time.monotonic() - started_at)
+        time.sleep(self.think)
+
+    def run_session(self, user_id: int):
+        '''Upload a document, change the pages and the copies, then print it.'''
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+        chat = {'id': user_id, 'type': 'private'}
+
+        def message(**fields) -> dict:
+            return {'message': dict(fields, message_id=next(self.update_ids),
+                                    date=int(time.time()), chat=chat)}
+
+        def text(value: str) -> dict:
+            return message(**{'from': user, 'text': value})
+
+        def callback(data: str) -> dict:
+            return {'callback_query': {
+                'id': str(next(self.update_ids)),
+                'from': user,
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat},
+            }}
+
+        self.send('start', message(**{
+            'from': user,
+            'text': f'/start {AUTH_TOKEN}',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        }))
+        self.send('upload', message(**{'from': user, 'document': {
+            'file_id': f'document-{user_id}',
+            'file_unique_id': f'document-{user_id}',
+            'file_name': 'document.pdf',
+            'mime_type': 'application/pdf',
+            'file_size': os.path.getsize(self.telegram.document_path),
+        }}), reply_from=user_id)
+
+        markup = json.loads(self.telegram.markups[user_id])
+        job_id = markup['inline_keyboard'][0][0]['callback_data'].split(':')[0]
+
+        self.send('pages', callback(f'{job_id}:pages'))
+        self.send('pages_input', text('2'))
+        self.send('pages_back', callback(f'{job_id}:pages:back'))
+        self.send('copies', callback(f'{job_id}:copies'))
+        self.send('copies_input', text('2'))
+        self.send('copies_back', callback(f'{job_id}:copies:back'))
+        self.send('print', callback(f'{job_id}:print'))
+
+    def run(self, sessions: int, rate: float) -> float:
+        '''Start the sessions at the given rate per second, return how long they took.'''
+        threads = []
+        errors = []
+
+        def session(user_id: int):
+            try:
+                self.run_session(user_id)
+            except Exception as error:  # pylint: disable=broad-except
+                errors.append(error)
+
+        started_at = time.monotonic()
+        for idx in range(sessions):
+            thread = Thread(target=session, args=(1000 + idx,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            time.sleep(1 / rate)
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            print(f'{len(errors)} session(s) failed, the first error: {errors[0]!r}')
+        return time.monotonic() - started_at
+
+
+def main():
+    '''Run the simulated sessions and report how the bot kept up.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=5, help='new sessions per second')
+    parser.add_argument('--pages', type=int, default=20, help='pages in the uploaded document')
+    parser.add_argument('--think', type=float, default=0.1,
+                        help='seconds a user waits between actions')
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+
+    directory = TemporaryDirectory(prefix='load-test-')  # pylint: disable=consider-using-with
+    setup_environment(directory.name, args.pages_per_minute)
+    document_path = os.path.join(directory.name, 'document.pdf')
+    write_document(document_path, args.pages)
+
+    # pylint: disable=import-outside-toplevel
+    from src.cups_server import fake_server
+    from src.fakes import FakeTelegram
+    from src.scheduler import scheduler
+
+    telegram = FakeTelegram(document_path, args.latency)
+    updater = start_bot(telegram)
+    harness = Harness(updater, telegram, args.think)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    duration = harness.run(args.sessions, args.rate)
+    drained_in = drain(args.drain)
+
+    updates = sum(len(latencies) for latencies in harness.latencies.values())
+    print(f'{args.sessions} sessions in {duration:.1f} s: '
+          f'{args.sessions / duration:.2f} sessions/s, {updates / duration:.1f} updates/s')
+    print(f'Printed {fake_server.printed_pages} pages, the queues drained {drained_in:.1f} s '
+          f'after the last session, {scheduler.held()} job(s) still held')
+    print('Handler latency, including the time waiting in the update queue:')
+    all_latencies = []
+    for step, latencies in harness.latencies.items():
+        all_latencies += latencies
+        print(f'  {step:>14}: p50 {quantile(latencies, 0.5) * 1000:8.1f} ms, '
+              f'p99 {quantile(latencies, 0.99) * 1000:8.1f} ms')
+    print(f'  {"all":>14}: p50 {quantile(all_latencies, 0.5) * 1000:8.1f} ms, '
+          f'p99 {quantile(all_latencies, 0.99) * 1000:8.1f} ms')
+    print('Telegram calls: ' + ', '.join(
+        f'{method} ×{amount}' for method, amount in sorted(telegram.calls.items())
+    ))
+    print_rss_growth(rss_before)
+
+    stop_bot(updater)
+
+
+if __name__ == '__main__':
+    main()
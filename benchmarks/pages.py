@@ -0,0 +1,227 @@
+'''Measure the time and peak memory of the PDF and page selection hot paths
+on synthetic documents, optionally comparing them to a saved baseline.
+
+The printers are simulated in memory (CUPS_FAKE=1), so CUPS isn't needed.
+
+benchmarks/baseline.json holds the results of the tree before the optimizations (commit 8948732),
+where the orientation and page selection cases ran through `is_portrait` and
+`apply_page_selection`. Compare to it with:
+
+    python -m benchmarks.pages --compare benchmarks/baseline.json
+
+Timings only compare on the same machine, elsewhere save a baseline of your own first.
+
+Usage: python -m benchmarks.pages [--sizes 1,10,100,1000,5000] [--repeat 3]
+                                  [--save baseline.json] [--compare baseline.json]
+                                  [--tolerance 1.25] [--min-seconds 0.001]
+'''
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from io import BytesIO
+from tempfile import TemporaryDirectory, TemporaryFile
+from typing import Callable, Dict
+
+from PIL import Image
+from PyPDF4 import PdfFileReader, PdfFileWriter
+
+SPOOL = TemporaryDirectory(prefix='benchmark-spool-')  # pylint: disable=consider-using-with
+os.environ.setdefault('CUPS_FAKE', '1')
+os.environ.setdefault('SPOOL_DIR', SPOOL.name)
+
+# pylint: disable=wrong-import-position
+from src.page_selection import PageSelection
+from src.print_job import PrintJob
+from src.sheet_planner import SheetPlanner
+from src.spool import SpoolFile
+from src.utils import count_orientations, write_pages
+
+# A4 in PostScript points
+PAGE_SIZE = (595, 842)
+# Every this many pages is landscape, and every this many is a full-page image
+LANDSCAPE_EVERY = 7
+IMAGE_EVERY = 20
+
+
+def image_page() -> bytes:
+    '''Return a single page PDF with a noisy image, which compresses poorly.'''
+    image = Image.effect_noise((800, 1100), 64).convert('RGB')
+    output = BytesIO()
+    image.save(output, 'PDF', resolution=100)
+    return output.getvalue()
+
+
+def synthetic_pdf(pages: int) -> bytes:
+    '''Return a PDF with a mix of portrait, landscape and image pages.'''
+    writer = PdfFileWriter()
+    image = image_page()
+    # The writer reads the pages from their readers when it writes the output
+    image_readers = []
+    for page_idx in range(pages):
+        if page_idx % IMAGE_EVERY == IMAGE_EVERY - 1:
+            # Every image page has its own copy of the image, like in a scanned document
+            reader = PdfFileReader(BytesIO(image))
+            image_readers.append(reader)
+            writer.addPage(reader.getPage(0))
+        elif page_idx % LANDSCAPE_EVERY == LANDSCAPE_EVERY - 1:
+            writer.addBlankPage(*PAGE_SIZE[::-1])
+        else:
+            writer.addBlankPage(*PAGE_SIZE)
+
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def fragmented_selection(pages: int) -> PageSelection:
+    '''Return a selection of every other page, the worst case for the interval list.'''
+    selection = PageSelection(pages)
+    selection.clear()
+    for page_idx in range(0, pages, 2):
+        selection.add(slice(page_idx, page_idx + 1))
+    return selection
+
+
+def spool(content: bytes) -> SpoolFile:
+    '''Write the content into a new spool file.'''
+    file = SpoolFile.create()
+    file.write(content)
+    file.flush()
+    file.seek(0)
+    return file
+
+
+def cases(pages: int, content: bytes) -> Dict[str, Callable[[], Callable[[], object]]]:
+    '''Return the benchmarks for a document of the given size.
+       Each one prepares its input and returns the function to measure.'''
+    def selection_add():
+        selection = PageSelection(pages)
+        selection.clear()
+        return lambda: [selection.add(slice(idx, idx + 1)) for idx in range(0, pages, 2)]
+
+    def selection_remove():
+        selection = PageSelection(pages)
+        return lambda: [selection.remove(slice(idx, idx + 1)) for idx in range(0, pages, 2)]
+
+    def selection_contains():
+        selection = fragmented_selection(pages)
+        return lambda: [idx in selection for idx in range(pages)]
+
+    def selection_n_up():
+        selection = fragmented_selection(pages)
+        selection.per_page = 4
+        return lambda: list(selection.n_up)
+
+    def selection_str():
+        selection = fragmented_selection(pages)
+        return lambda: str(selection)
+
+    def orientations():
+        reader = PdfFileReader(BytesIO(content))
+        return lambda: count_orientations(reader)
+
+    def page_selection():
+        reader = PdfFileReader(spool(content))
+        selection = fragmented_selection(pages)
+        # Like the print file of a job
+        return lambda: write_pages(reader, selection, TemporaryFile())
+
+    def page_selection_turned():
+        reader = PdfFileReader(spool(content))
+        selection = fragmented_selection(pages)
+        planner = SheetPlanner(portrait=True, duplex=True, per_page=1)
+        return lambda: write_pages(reader, selection, TemporaryFile(), planner=planner)
+
+    def job_init():
+        file = spool(content)
+        return lambda: PrintJob(file, False, 'pages 1-3, 5', 1)
+
+    return {
+        'PageSelection.add': selection_add,
+        'PageSelection.remove': selection_remove,
+        'PageSelection.__contains__': selection_contains,
+        'PageSelection.n_up': selection_n_up,
+        'PageSelection.__str__': selection_str,
+        'utils.count_orientations': orientations,
+        'utils.write_pages': page_selection,
+        'utils.write_pages+SheetPlanner': page_selection_turned,
+        'PrintJob.__init__': job_init,
+    }
+
+
+def measure(prepare: Callable[[], Callable[[], object]], repeat: int) -> dict:
+    '''Return the best time and the peak memory allocated by the function.
+       The input is prepared anew for every run, outside of the measurements.'''
+    timings = []
+    for _ in range(repeat):
+        function = prepare()
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+
+    # Tracing slows the code down, so memory is measured in a separate run
+    function = prepare()
+    tracemalloc.start()
+    function()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(timings), 'peak_bytes': peak}
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_seconds: float) -> int:
+    '''Print the changes relative to the baseline and return the amount of regressions.
+       Timings shorter than `min_seconds` are too noisy to compare.'''
+    regressions = 0
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if metric == 'seconds' and max(result[metric], previous[metric]) < min_seconds:
+                continue
+            ratio = result[metric] / previous[metric] if previous[metric] else 1.0
+            if ratio > tolerance:
+                regressions += 1
+                print(f'REGRESSION {name} {metric}: {previous[metric]:.6g} → {result[metric]:.6g} '
+                      f'(×{ratio:.2f})')
+    return regressions
+
+
+def main():
+    '''Measure every case for every document size, then save or compare the results.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1,10,100,1000,5000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='the slowdown or memory growth ratio that counts as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.001,
+                        help='do not compare timings shorter than this')
+    args = parser.parse_args()
+
+    results = {}
+    for pages in (int(size) for size in args.sizes.split(',')):
+        content = synthetic_pdf(pages)
+        print(f'{pages} pages, {len(content) / 1024 / 1024:.1f} MB')
+        for name, prepare in cases(pages, content).items():
+            result = results[f'{name}[{pages}]'] = measure(prepare, args.repeat)
+            print(f'  {name:>30}: {result["seconds"] * 1000:10.2f} ms, '
+                  f'peak {result["peak_bytes"] / 1024:10.1f} KiB')
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance, args.min_seconds)
+        if regressions:
+            raise SystemExit(f'{regressions} regression(s) compared to {args.compare}')
+        print(f'No regressions compared to {args.compare}')
+
+
+if __name__ == '__main__':
+    main()
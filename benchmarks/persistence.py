@@ -0,0 +1,56 @@
+'''Compare the cost of persisting user data changes with pickle and SQLite backends.
+
+Usage: python -m benchmarks.persistence [--users 10000] [--updates 200]
+'''
+import argparse
+import os
+import time
+from tempfile import TemporaryDirectory
+
+from telegram.ext import PicklePersistence
+
+from src.sqlite_persistence import SQLitePersistence
+
+
+def populate(persistence, users: int):
+    '''Fill the persistence with authenticated users and flush it.'''
+    for user_id in range(users):
+        persistence.update_user_data(user_id, {'authenticated': True, 'toner_save': True})
+    persistence.flush()
+
+
+def measure(persistence, users: int, updates: int) -> dict:
+    '''Time changing one user's data at a time, followed by a flush.'''
+    populate(persistence, users)
+
+    started_at = time.perf_counter()
+    for idx in range(updates):
+        user_id = idx * 7919 % users
+        persistence.update_user_data(user_id, {'authenticated': True, 'toner_save': idx % 2 == 0})
+        persistence.flush()
+    elapsed = time.perf_counter() - started_at
+
+    return {'per_update_ms': elapsed / updates * 1000}
+
+
+def main():
+    '''Compare the cost of flushing changed users with each backend.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=200)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        backends = {
+            'pickle': PicklePersistence(os.path.join(directory, 'data.pkl'), store_bot_data=False),
+            'sqlite': SQLitePersistence(os.path.join(directory, 'data.sqlite3'),
+                                        store_bot_data=False),
+        }
+        for name, persistence in backends.items():
+            result = measure(persistence, args.users, args.updates)
+            print(f'{name:>8}: {result["per_update_ms"]:.3f} ms per changed user + flush '
+                  f'({args.users} users)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''Measure the cost of rendering the status messages and keyboards that every button press
+sends back, including serializing the keyboard the way the bot does before the request.
+
+The jobs are restored from synthetic records in different states and with different settings,
+so that every render is for a different job, like under heavy button traffic.
+
+Usage: python -m benchmarks.render [--jobs 1000] [--rounds 20]
+'''
+import argparse
+import os
+import time
+from tempfile import TemporaryDirectory
+
+SPOOL = TemporaryDirectory(prefix='benchmark-spool-')  # pylint: disable=consider-using-with
+os.environ.setdefault('CUPS_FAKE', '1')
+os.environ.setdefault('SPOOL_DIR', SPOOL.name)
+
+# pylint: disable=wrong-import-position
+from src.options import advanced, copies, pages
+from src.print_job import PrintJob
+
+from .jobs import synthetic_record
+from .pages import spool, synthetic_pdf
+
+STATES = (PrintJob.STATE_PREPARING, PrintJob.STATE_QUEUED, PrintJob.STATE_WAITING)
+
+
+def synthetic_jobs(amount: int, spool_path: str) -> list:
+    '''Return jobs in the states that have buttons, with a mix of settings.'''
+    jobs = []
+    for idx in range(amount):
+        record = synthetic_record(idx, spool_path)
+        record['state'] = STATES[idx % len(STATES)]
+        record['copies'] = 1 + idx % 3
+        record['duplex'] = idx % 2 == 0
+        record['per_page'] = (1, 2, 4)[idx % 3]
+        job = PrintJob.from_record(record)
+        job.queue_position = idx % 10
+        jobs.append(job)
+    return jobs
+
+
+def serialized(markup) -> str:
+    '''Return the keyboard as the bot sends it.'''
+    return markup.to_json() if markup is not None else ''
+
+
+def screens() -> dict:
+    '''Return the renders of the screens that the buttons lead to.'''
+    return {
+        'status': lambda job: (job.get_message_text(), serialized(job.get_keyboard())),
+        'advanced': lambda job: (advanced.status_text(job),
+                                 serialized(advanced.get_keyboard(job))),
+        'pages': lambda job: serialized(pages.get_keyboard(pages.State.ADD, job.id)),
+        'copies': lambda job: serialized(copies.get_keyboard(job)),
+    }
+
+
+def main():
+    '''Time every screen across the synthetic jobs.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    container = spool(synthetic_pdf(10))
+    container.close()
+    jobs = synthetic_jobs(args.jobs, container.name)
+
+    for name, render in screens().items():
+        timings = []
+        for _ in range(args.rounds):
+            started_at = time.perf_counter()
+            for job in jobs:
+                render(job)
+            timings.append(time.perf_counter() - started_at)
+        print(f'{name:>10}: {min(timings) / len(jobs) * 1e6:6.1f} µs per callback')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+'''Replay an update trace recorded with RECORD_TRACE against a fake Telegram
+and simulated printers, at the recorded pace, faster or as fast as possible.
+
+The documents are replaced by stand-ins of the same type and size:
+noise images for pictures, PDFs of noise image pages and random text.
+Other types, which would need LibreOffice, are replaced by PDFs of the same size.
+
+Usage: python -m benchmarks.replay trace.jsonl [--speed 1] [--pages-per-minute 600]
+                                               [--latency 0.05] [--drain 60]
+'''
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import string
+import time
+from collections import defaultdict
+from io import BytesIO
+from queue import Queue
+from tempfile import TemporaryDirectory
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional
+
+from PIL import Image
+from PyPDF4 import PdfFileReader, PdfFileWriter
+from telegram import Update
+
+from .load import (add_simulation_arguments, drain, print_rss_growth, quantile,
+                   setup_environment, signal_handled, start_bot, stop_bot)
+
+IMAGE_FORMATS = {
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG',
+    'image/gif': 'GIF',
+    'image/bmp': 'BMP',
+    'image/tiff': 'TIFF',
+    'image/webp': 'WEBP',
+}
+# How long a button press may wait for the job it refers to
+JOB_TIMEOUT = 60
+job_id_ptn = re.compile(r'^([0-9a-f]+):')
+
+
+def noise_image(size: int, image_format: str) -> bytes:
+    '''Return a noise image that takes about `size` bytes in the format.'''
+    side = 256
+    for _ in range(3):
+        image = Image.effect_noise((side, side), 64).convert('RGB')
+        output = BytesIO()
+        image.save(output, image_format)
+        side = max(16, int(side * (size / len(output.getvalue())) ** 0.5))
+    return output.getvalue()
+
+
+def noise_pdf(size: int) -> bytes:
+    '''Return a PDF of noise image pages that takes about `size` bytes.'''
+    page = noise_image(min(size, 256 * 1024), 'PDF')
+    writer = PdfFileWriter()
+    # Every page gets its own copy of the image, otherwise the writer would share it
+    readers = [PdfFileReader(BytesIO(page)) for _ in range(max(1, round(size / len(page))))]
+    for reader in readers:
+        writer.addPage(reader.getPage(0))
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def noise_text(size: int) -> bytes:
+    '''Return random words that take `size` bytes.'''
+    alphabet = string.ascii_letters + ' ' * 10 + '\n'
+    return ''.join(random.choices(alphabet, k=size)).encode()
+
+
+def stand_in(document: dict) -> bytes:
+    '''Return the contents of a file of the same type and size as the document.
+       Types without an in-process converter get a PDF instead, and the document is changed
+       to match.'''
+    size = document.get('file_size') or 100 * 1024
+    mime_type = document.get('mime_type')
+    if mime_type in IMAGE_FORMATS:
+        return noise_image(size, IMAGE_FORMATS[mime_type])
+    if mime_type == 'text/plain':
+        return noise_text(size)
+    if mime_type != 'application/pdf':
+        document['mime_type'] = 'application/pdf'
+        document['file_name'] = os.path.splitext(document.get('file_name', 'document'))[0] + '.pdf'
+    return noise_pdf(size)
+
+
+def update_kind(payload: dict) -> str:
+    '''Return a short description of the update for the report, like `callback pages:back`.'''
+    message = payload.get('message') or payload.get('edited_message')
+    if payload.get('callback_query') is not None:
+        data = payload['callback_query'].get('data') or ''
+        return 'callback ' + job_id_ptn.sub('', data)
+    if message is None:
+        return 'other'
+    if message.get('document') is not None:
+        return 'document ' + message['document'].get('mime_type', '?')
+    text = message.get('text') or ''
+    return text if text.startswith('/') else 'text'
+
+
+def chat_of(payload: dict) -> int:
+    '''Return the ID of the chat the update comes from, 0 if there isn't one.'''
+    message = payload.get('message') or payload.get('edited_message')
+    if message is None and payload.get('callback_query') is not None:
+        message = payload['callback_query'].get('message')
+    return message['chat']['id'] if message is not None else 0
+
+
+class Replayer:
+    '''Feeds the recorded updates to the dispatcher at their (scaled) recorded times.
+
+       The updates of every chat are fed in order by a thread of their own, each one
+       no earlier than the previous one was handled, like a real user waits for the replies.
+       Chats don't wait for each other, so the bot gets the recorded load even if it lags.'''
+
+    def __init__(self, updater, telegram, speed: float, max_download_size: int):
+        self.updater = updater
+        self.telegram = telegram
+        self.speed = speed
+        self.max_download_size = max_download_size
+        self.handled: Dict[int, Event] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.lags: List[float] = []
+        self.unmatched = 0
+        self.lock = Lock()
+        signal_handled(updater.dispatcher, self.handled, self.lock)
+
+    def prepare(self, records: List[dict], directory: str):
+        '''Write the stand-ins for the documents and let all the users in.'''
+        for record in records:
+            payload = record['update']
+            message = payload.get('message') or {}
+            document = message.get('document')
+            if document is not None and document['file_id'] not in self.telegram.documents:
+                path = os.path.join(directory, f'document-{len(self.telegram.documents)}')
+                if (document.get('file_size') or 0) <= self.max_download_size:
+                    with open(path, 'wb') as file:
+                        file.write(stand_in(document))
+                self.telegram.documents[document['file_id']] = path
+
+            user = (message or payload.get('callback_query') or {}).get('from')
+            if user is not None:
+                # The authentication tokens aren't recorded
+                self.updater.dispatcher.user_data[user['id']]['authenticated'] = True
+
+    def resolve_job(self, payload: dict) -> bool:
+        '''Point a button press to the job of this replay that stands for the recorded one.
+           Return whether the job was found in time.'''
+        query = payload['callback_query']
+        message = query.get('message') or {}
+        original = message.get('reply_to_message')
+        recorded = job_id_ptn.match(query.get('data') or '')
+        if original is None or recorded is None:
+            return False
+
+        key = (message['chat']['id'], original['message_id'])
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while key not in self.telegram.replies:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        markup = json.loads(self.telegram.replies[key])
+        job_id = job_id_ptn.match(markup['inline_keyboard'][0][0]['callback_data']).group(1)
+        query['data'] = job_id + query['data'][len(recorded.group(1)):]
+        return True
+
+    def feed_chat(self, records: Queue, started_at: float):
+        '''Feed the updates of a chat in order, each one after the previous was handled.'''
+        previous: Optional[Event] = None
+        while True:
+            record = records.get()
+            if record is None:
+                break
+            payload = record['update']
+            kind = update_kind(payload)
+            if previous is not None:
+                previous.wait(timeout=JOB_TIMEOUT)
+            if payload.get('callback_query') is not None and not self.resolve_job(payload):
+                with self.lock:
+                    self.unmatched += 1
+
+            scheduled_at = started_at + (record['time'] / self.speed if self.speed else 0)
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            update = Update.de_json(payload, self.updater.bot)
+            event = previous = Event()
+            with self.lock:
+                self.handled[update.update_id] = event
+                self.lags.append(max(0.0, -delay))
+            fed_at = time.monotonic()
+            self.updater.dispatcher.update_queue.put(update)
+            Thread(target=self.measure, args=(kind, event, fed_at), daemon=True).start()
+        if previous is not None:
+            previous.wait(timeout=JOB_TIMEOUT)
+
+    def measure(self, kind: str, event: Event, fed_at: float):
+        '''Record how long the update took to handle, including the time in the queue.'''
+        if event.wait(timeout=JOB_TIMEOUT):
+            with self.lock:
+                self.latencies[kind].append(time.monotonic() - fed_at)
+
+    def run(self, records: List[dict]) -> float:
+        '''Replay the updates, return how long it took.'''
+        chats: Dict[int, Queue] = {}
+        threads = []
+        started_at = time.monotonic()
+        for record in records:
+            chat_id = chat_of(record['update'])
+            if chat_id not in chats:
+                chats[chat_id] = Queue()
+                thread = Thread(target=self.feed_chat,
+                                args=(chats[chat_id], started_at),
+                                daemon=True)
+                thread.start()
+                threads.append(thread)
+            chats[chat_id].put(record)
+        for queue in chats.values():
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+        return time.monotonic() - started_at
+
+
+def main():
+    '''Replay the trace against the bot and report how it kept up.'''
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('trace', help='a JSON Lines file recorded with RECORD_TRACE')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='how many times faster than recorded to replay, 0 for no pauses')
+    add_simulation_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.trace, encoding='utf-8') as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    records.sort(key=lambda record: record['time'])
+
+    directory = TemporaryDirectory(prefix='replay-')  # pylint: disable=consider-using-with
+    setup_environment(directory.name, args.pages_per_minute)
+
+    # pylint: disable=import-outside-toplevel
+    from src.cups_server import fake_server
+    from src.downloads import MAX_DOWNLOAD_SIZE
+    from src.fakes import FakeTelegram
+    from src.scheduler import scheduler
+
+    telegram = FakeTelegram(os.devnull, args.latency)
+    updater = start_bot(telegram)
+    replayer = Replayer(updater, telegram, args.speed, MAX_DOWNLOAD_SIZE)
+    replayer.prepare(records, directory.name)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    duration = replayer.run(records)
+    drained_in = drain(args.drain)
+
+    recorded = records[-1]['time'] if records else 0
+    print(f'{len(records)} updates recorded over {recorded:.1f} s, '
+          f'replayed in {duration:.1f} s: {len(records) / duration:.1f} updates/s')
+    print(f'Printed {fake_server.printed_pages} pages, the queues drained {drained_in:.1f} s '
+          f'after the last update, {scheduler.held()} job(s) still held')
+    print(f'Fed late by p50 {quantile(replayer.lags, 0.5) * 1000:.1f} ms, '
+          f'p99 {quantile(replayer.lags, 0.99) * 1000:.1f} ms; '
+          f'{replayer.unmatched} button press(es) matched no job')
+    print('Handler latency, including the time waiting in the update queue:')
+    all_latencies = []
+    for kind, latencies in sorted(replayer.latencies.items()):
+        all_latencies += latencies
+        print(f'  {kind:>32} ×{len(latencies):<5}: '
+              f'p50 {quantile(latencies, 0.5) * 1000:8.1f} ms, '
+              f'p99 {quantile(latencies, 0.99) * 1000:8.1f} ms')
+    print(f'  {"all":>32} ×{len(all_latencies):<5}: '
+          f'p50 {quantile(all_latencies, 0.5) * 1000:8.1f} ms, '
+          f'p99 {quantile(all_latencies, 0.99) * 1000:8.1f} ms')
+    print_rss_growth(rss_before)
+
+    stop_bot(updater)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,29 @@
+import os
 import subprocess
 
 from src.cups_server import notifier
 from src.main import updater
+from src.metrics import start_server as start_metrics_server
 
 
 unoconv_listener = subprocess.Popen(['unoconv', '--listener'])
 
-updater.start_polling()
+if os.getenv('METRICS_PORT'):
+    start_metrics_server(int(os.getenv('METRICS_PORT')), os.getenv('METRICS_ADDRESS', '127.0.0.1'))
+
+if os.getenv('WEBHOOK_URL'):
+    # Several workers can share the load behind a proxy that fans the webhook out to them.
+    #   The proxy must route each chat to the same worker, since conversation states
+    #   and user data are cached in the worker's memory.
+    updater.start_webhook(
+        listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+        port=int(os.getenv('WEBHOOK_PORT', '8443')),
+        url_path=os.getenv('WEBHOOK_PATH', ''),
+    )
+    if os.getenv('WEBHOOK_SET', '1') == '1':
+        updater.bot.set_webhook(os.getenv('WEBHOOK_URL'))
+else:
+    updater.start_polling()
 updater.idle()
 
 notifier.unsubscribe_all()
@@ -11,7 +11,7 @@ def exclude_title(update: Update, context: CallbackContext):
     job = context.bot_data['jobs'][id]
     job.pages.remove(slice(0, 1))
 
-    job.status_message.edit_text(
+    job.edit_status(
         job.get_message_text(),
         parse_mode=ParseMode.HTML,
         reply_markup=job.get_keyboard(),
@@ -0,0 +1,57 @@
+from io import BytesIO
+from itertools import islice
+
+from telegram import Update, InputMediaPhoto
+from telegram.ext import (
+    CallbackContext,
+    CallbackQueryHandler,
+)
+
+from ..number_up_layout import Layout, layouts
+from ..thumbnails import render_sheets
+from ..utils import s
+
+PREVIEW_SHEETS = 4
+
+
+def send_page_preview(update: Update, context: CallbackContext):
+    '''Send small images of the first few sheets as they will be printed.'''
+    id = update.callback_query.data.split(':')[0]
+    job = context.bot_data['jobs'].get(id)
+    if job is None:
+        update.callback_query.answer('This job has expired')
+        return
+    update.callback_query.answer('Rendering the preview...')
+
+    # Rendering takes a while, so it runs in a worker with the settings as they are now
+    context.dispatcher.run_async(reply_with_sheets,
+                                 update,
+                                 job,
+                                 list(islice(job.pages.n_up, PREVIEW_SHEETS)),
+                                 layouts[job.pages.per_page],
+                                 job.pages.to_print,
+                                 update=update)
+
+
+def reply_with_sheets(update: Update, job, sheets: list, layout: Layout, to_print: int):
+    '''Render the sheets and send them in reply to the document.'''
+    images = render_sheets(job.spool_path, job.get_content_hash(), sheets, layout)
+    caption = (f'The first {len(images)} sheet{s(len(images))} '
+               f'out of {to_print}, as they will be printed')
+    reply_to_message_id = update.effective_message.reply_to_message.message_id
+
+    if len(images) == 1:
+        update.effective_message.reply_photo(
+            BytesIO(images[0]),
+            caption=caption,
+            reply_to_message_id=reply_to_message_id,
+        )
+    else:
+        update.effective_message.reply_media_group(
+            [InputMediaPhoto(BytesIO(image), caption=caption if idx == 0 else None)
+             for idx, image in enumerate(images)],
+            reply_to_message_id=reply_to_message_id,
+        )
+
+
+page_preview_handler = CallbackQueryHandler(send_page_preview, pattern='[0-9a-f]+:page_preview')
@@ -11,7 +11,7 @@ def parse_caption(update: Update, context: CallbackContext):
     job = context.bot_data['jobs'][id]
     job.parse_caption()
 
-    job.status_message.edit_text(
+    job.edit_status(
         job.get_message_text(),
         parse_mode=ParseMode.HTML,
         reply_markup=job.get_keyboard(),
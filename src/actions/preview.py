@@ -8,15 +8,24 @@ from telegram.ext import (
 def send_preview(update: Update, context: CallbackContext):
     '''Send the result of conversion to PDF for inspection.'''
     id = update.callback_query.data.split(':')[0]
-    job = context.bot_data['jobs'][id]
+    jobs = context.bot_data['jobs']
+    job = jobs[id]
 
-    update.effective_message.reply_document(
-        job.container,
-        filename=job.container.original_name[:job.container.original_name.rfind('.')] + '.pdf',
-        caption='For best results, save the file as PDF manually.',
-        reply_to_message_id=update.effective_message.reply_to_message.message_id,
-    )
-    job.container.seek(0)
+    # Once uploaded, the same file can be sent by reference instead of uploading it again
+    if job.preview_file_id is None:
+        job.preview_file_id = jobs.store.get_preview(job.get_content_hash())
+
+    with job.open() as container:
+        message = update.effective_message.reply_document(
+            job.preview_file_id or container,
+            filename=job.original_name[:job.original_name.rfind('.')] + '.pdf',
+            caption='For best results, save the file as PDF manually.',
+            reply_to_message_id=update.effective_message.reply_to_message.message_id,
+        )
+
+    if job.preview_file_id is None:
+        job.preview_file_id = message.document.file_id
+        jobs.store.save_preview(job.get_content_hash(), job.preview_file_id)
     update.callback_query.answer()
 
 
@@ -8,7 +8,7 @@ from telegram.ext import (
 def start_print_job(update: Update, context: CallbackContext):
     '''Start the printing job.'''
     id = update.callback_query.data.split(':')[0]
-    context.bot_data['jobs'][id].start()
+    context.bot_data['jobs'][id].submit()
 
     update.callback_query.answer('Submitted for printing!')
 
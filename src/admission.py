@@ -0,0 +1,150 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+from .metrics import counter, gauge
+
+# Every user may upload this many files in a row, then one more every this many seconds
+UPLOAD_BURST = int(os.getenv('UPLOAD_BURST', '20'))
+UPLOAD_INTERVAL = float(os.getenv('UPLOAD_INTERVAL_SECONDS', '6'))
+# The same for the files that have to be converted to PDF, which take far longer
+CONVERSION_BURST = int(os.getenv('CONVERSION_BURST', '10'))
+CONVERSION_INTERVAL = float(os.getenv('CONVERSION_INTERVAL_SECONDS', '20'))
+# How many documents are downloaded and converted at once, and how many may wait for that
+MAX_CONVERSIONS = int(os.getenv('CONVERSION_WORKERS', '4'))
+MAX_QUEUED_CONVERSIONS = int(os.getenv('MAX_QUEUED_CONVERSIONS', '100'))
+
+rejected_total = counter('printer_admission_rejected',
+                         'Documents turned away because of a rate or queue limit',
+                         ['limit'])
+admission_limit = gauge('printer_admission_limit',
+                        'The configured admission limits',
+                        ['setting'])
+
+
+class QueueFull(Exception):
+    '''Raised when too many documents are already waiting for a conversion.'''
+
+
+class TokenBucket:
+    '''Allows `capacity` actions in a row, then one more every `interval` seconds.'''
+
+    def __init__(self, capacity: int, interval: float):
+        self.capacity = capacity
+        self.interval = interval
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        '''Add the tokens accumulated since the last time.'''
+        now = time.monotonic()
+        if self.interval > 0:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated_at) / self.interval)
+        else:
+            self.tokens = self.capacity
+        self.updated_at = now
+
+    def take(self) -> bool:
+        '''Use up a token, return whether there was one.'''
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self) -> float:
+        '''Return how many seconds until the next token.'''
+        self.refill()
+        return max(0.0, (1 - self.tokens) * self.interval)
+
+    def is_full(self) -> bool:
+        '''Check whether the bucket is back to its capacity.'''
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    '''A token bucket for every user.'''
+
+    def __init__(self, name: str, capacity: int, interval: float):
+        self.name = name
+        self.capacity = capacity
+        self.interval = interval
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.lock = Lock()
+        admission_limit.labels(f'{name}_burst').set(capacity)
+        admission_limit.labels(f'{name}_interval_seconds').set(interval)
+
+    def allow(self, user_id: int) -> Tuple[bool, float]:
+        '''Take a token from the user's bucket.
+           Return whether the user may go on and, if not, how many seconds they should wait.'''
+        with self.lock:
+            bucket = self.buckets.get(user_id)
+            if bucket is None:
+                bucket = self.buckets[user_id] = TokenBucket(self.capacity, self.interval)
+            if bucket.take():
+                return True, 0.0
+            wait_time = bucket.wait_time()
+        rejected_total.labels(self.name).inc()
+        return False, wait_time
+
+    def forget_idle(self):
+        '''Drop the buckets of the users who are back to the full allowance.'''
+        with self.lock:
+            self.buckets = {user_id: bucket for user_id, bucket in self.buckets.items()
+                            if not bucket.is_full()}
+
+
+class ConversionQueue:
+    '''Downloads and converts documents on a pool of `limit` threads, the rest wait in line.'''
+
+    def __init__(self, limit: int, max_queued: int):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.pool = ThreadPoolExecutor(max_workers=limit, thread_name_prefix='conversion')
+        # Admitted, but not yet finished
+        self.pending = 0
+        self.lock = Lock()
+        admission_limit.labels('max_conversions').set(limit)
+        admission_limit.labels('max_queued_conversions').set(max_queued)
+
+    def submit(self, function: Callable, *args) -> Tuple[Future, int]:
+        '''Run the function when a worker is free.
+           Return its future and its place in line, 0 if it started right away.'''
+        with self.lock:
+            position = max(0, self.pending + 1 - self.limit)
+            if position > self.max_queued:
+                rejected_total.labels('queue').inc()
+                raise QueueFull()
+            self.pending += 1
+
+        future = self.pool.submit(function, *args)
+        future.add_done_callback(self.finished)
+        return future, position
+
+    def finished(self, _future: Future):
+        '''Let the next document in line take the place.'''
+        with self.lock:
+            self.pending -= 1
+
+    def in_flight(self) -> int:
+        '''Return the amount of documents being downloaded or converted.'''
+        with self.lock:
+            return min(self.pending, self.limit)
+
+    def queued(self) -> int:
+        '''Return the amount of documents waiting for a worker.'''
+        with self.lock:
+            return max(0, self.pending - self.limit)
+
+
+upload_limiter = RateLimiter('upload', UPLOAD_BURST, UPLOAD_INTERVAL)
+conversion_limiter = RateLimiter('conversion', CONVERSION_BURST, CONVERSION_INTERVAL)
+conversions = ConversionQueue(MAX_CONVERSIONS, MAX_QUEUED_CONVERSIONS)
+gauge('printer_conversions_in_flight',
+      'Documents being downloaded and converted').set_function(conversions.in_flight)
+gauge('printer_conversion_queue_depth',
+      'Documents waiting to be downloaded and converted').set_function(conversions.queued)
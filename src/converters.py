@@ -0,0 +1,146 @@
+from io import BytesIO
+from typing import BinaryIO, Callable, Dict, List
+
+from PIL import Image, ImageOps
+
+from .work import WorkHandle
+
+# A4 in PostScript points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+IMAGE_DPI = 200
+TEXT_FONT_SIZE = 10
+TEXT_LEADING = 12
+TEXT_MARGIN = 50
+# Courier glyphs are 0.6 of the font size wide
+TEXT_COLUMNS = int((PAGE_WIDTH - 2 * TEXT_MARGIN) / (TEXT_FONT_SIZE * 0.6))
+TEXT_ROWS = int((PAGE_HEIGHT - 2 * TEXT_MARGIN) / TEXT_LEADING)
+
+converters: Dict[str, Callable[[BinaryIO], bytes]] = {}
+
+
+class UnsupportedContent(Exception):
+    '''Raised by a fast-path converter when the file needs the general converter.'''
+
+
+def converter(*mime_types: str):
+    '''Register the decorated function as the converter to PDF for the MIME types.'''
+    def register(function: Callable[[BinaryIO], bytes]):
+        for mime_type in mime_types:
+            converters[mime_type] = function
+        return function
+    return register
+
+
+def convert_with_unoconv(file: BinaryIO, handle: WorkHandle = None) -> bytes:
+    '''Convert any document LibreOffice can open.'''
+    file.flush()
+    return (handle or WorkHandle()).run(['unoconv', '--stdout', '-f', 'pdf', file.name],
+                                        timeout=60)
+
+
+@converter('image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/tiff', 'image/webp')
+def convert_image(file: BinaryIO) -> bytes:
+    '''Fit the image on an A4 page, turning the page to match the image orientation.'''
+    file.seek(0)
+    try:
+        image = ImageOps.exif_transpose(Image.open(file)).convert('RGB')
+    except OSError as error:
+        raise UnsupportedContent from error
+
+    page_size = (round(PAGE_WIDTH / 72 * IMAGE_DPI), round(PAGE_HEIGHT / 72 * IMAGE_DPI))
+    if image.width > image.height:
+        page_size = page_size[::-1]
+
+    margin = IMAGE_DPI // 4
+    image.thumbnail((page_size[0] - 2 * margin, page_size[1] - 2 * margin))
+    page = Image.new('RGB', page_size, 'white')
+    page.paste(image, ((page_size[0] - image.width) // 2, (page_size[1] - image.height) // 2))
+
+    output = BytesIO()
+    page.save(output, 'PDF', resolution=IMAGE_DPI)
+    return output.getvalue()
+
+
+def wrap_lines(text: str) -> List[str]:
+    '''Split the text into lines that fit the page width.'''
+    lines = []
+    for line in text.expandtabs(4).splitlines():
+        while len(line) > TEXT_COLUMNS:
+            lines.append(line[:TEXT_COLUMNS])
+            line = line[TEXT_COLUMNS:]
+        lines.append(line)
+    return lines or ['']
+
+
+def escape_text(line: str) -> bytes:
+    '''Encode a line as a PDF string literal.'''
+    encoded = line.encode('cp1252')
+    for char in (b'\\', b'(', b')'):
+        encoded = encoded.replace(char, b'\\' + char)
+    return b'(' + encoded + b')'
+
+
+def build_pdf(objects: List[bytes]) -> bytes:
+    '''Assemble numbered PDF objects (the first one being the catalog) into a file.'''
+    output = BytesIO()
+    output.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    xref_offset = output.tell()
+    output.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b'%010d 00000 n \n' % offset)
+    output.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                 % (len(objects) + 1, xref_offset))
+    return output.getvalue()
+
+
+@converter('text/plain')
+def convert_text(file: BinaryIO) -> bytes:
+    '''Typeset plain text in a monospace font.
+       Only the text that the built-in PDF fonts can show is supported.'''
+    file.seek(0)
+    try:
+        lines = wrap_lines(file.read().decode('utf-8-sig'))
+        escaped = [escape_text(line) for line in lines]
+    except UnicodeError as error:
+        raise UnsupportedContent from error
+
+    pages = [escaped[idx:idx + TEXT_ROWS] for idx in range(0, len(escaped), TEXT_ROWS)]
+    # 1: catalog, 2: page tree, 3: font, then a page and its content stream for every page
+    page_numbers = [4 + 2 * idx for idx in range(len(pages))]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % number for number in page_numbers), len(pages)
+        ),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+    ]
+    for number, page_lines in zip(page_numbers, pages):
+        content = b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+            TEXT_FONT_SIZE, TEXT_LEADING, TEXT_MARGIN, PAGE_HEIGHT - TEXT_MARGIN
+        )
+        content += b''.join(line + b" '\n" for line in page_lines) + b'ET'
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+            % (PAGE_WIDTH, PAGE_HEIGHT, number + 1)
+        )
+        objects.append(b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+
+    return build_pdf(objects)
+
+
+def convert(file: BinaryIO, mime: str, handle: WorkHandle = None) -> bytes:
+    '''Convert the file to PDF, in-process if possible, with LibreOffice otherwise.'''
+    fast_path = converters.get(mime)
+    if fast_path is not None:
+        try:
+            return fast_path(file)
+        except UnsupportedContent:
+            pass
+    return convert_with_unoconv(file, handle)
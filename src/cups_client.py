@@ -0,0 +1,101 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+from queue import LifoQueue, Empty
+from typing import Callable
+
+from cups import HTTPError, IPPError
+
+from .logs import get_logger
+from .metrics import histogram
+
+request_seconds = histogram('printer_cups_request_seconds',
+                            'Duration of CUPS requests, including retries',
+                            ['method'])
+
+# Calls that change the state of CUPS, which a failed attempt may have done already
+NOT_RETRIED = frozenset(('printFile', 'printFiles', 'createJob', 'moveJob'))
+
+logger = get_logger(__name__)
+
+
+class CupsTimeout(Exception):
+    '''Raised when a CUPS call does not complete before its deadline.'''
+
+
+class CupsClient:
+    '''A thread-safe facade over a pool of CUPS connections.
+
+       Any `cups.Connection` method can be called on the client directly,
+       e.g. `client.printFile(...)`. Each call borrows a connection for its duration,
+       runs under a deadline and is retried on a fresh connection if the old one fails.
+       IPP errors are reported by CUPS itself and are raised without retrying.
+       Calls that change the state of CUPS, like `printFile`, are only retried
+       if no connection could be made, since a failed call may still have reached CUPS.'''
+
+    def __init__(self,
+                 connection_factory: Callable,
+                 size: int = 4,
+                 timeout: float = 10.0,
+                 retries: int = 2,
+                 retry_delay: float = 0.5):
+        self.connection_factory = connection_factory
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.idle = LifoQueue(maxsize=size)
+        # Calls that hit their deadline keep a worker busy until they return, so leave headroom
+        self.executor = ThreadPoolExecutor(max_workers=size * 2, thread_name_prefix='cups')
+
+    def __getattr__(self, method: str):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return partial(self.call, method)
+
+    def acquire(self):
+        '''Take an idle connection from the pool or open a new one.'''
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            return self.connection_factory()
+
+    def release(self, connection):
+        '''Return a healthy connection to the pool.'''
+        if not self.idle.full():
+            self.idle.put_nowait(connection)
+
+    def call(self, method: str, *args, timeout: float = None, **kwargs):
+        '''Call a `cups.Connection` method with a deadline and bounded retries.'''
+        started_at = time.monotonic()
+        deadline = started_at + (timeout if timeout is not None else self.timeout)
+
+        try:
+            attempt = 0
+            while True:
+                connection = None
+                try:
+                    connection = self.executor.submit(self.acquire).result(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+                    future = self.executor.submit(getattr(connection, method), *args, **kwargs)
+                    result = future.result(timeout=max(0, deadline - time.monotonic()))
+                except FutureTimeout as error:
+                    # The connection is still busy with the call, so it is abandoned
+                    raise CupsTimeout(f'{method} did not complete in time') from error
+                except IPPError:
+                    self.release(connection)
+                    raise
+                except (HTTPError, RuntimeError, OSError) as error:
+                    # pycups reports failures to connect as RuntimeError
+                    if (attempt == self.retries
+                            or time.monotonic() + self.retry_delay >= deadline
+                            or (connection is not None and method in NOT_RETRIED)):
+                        raise
+                    logger.warning('CUPS call {} failed ({}), reconnecting', method, error)
+                    time.sleep(self.retry_delay)
+                    attempt += 1
+                else:
+                    self.release(connection)
+                    return result
+        finally:
+            request_seconds.labels(method).observe(time.monotonic() - started_at)
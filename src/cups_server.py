@@ -1,10 +1,38 @@
 import os
 
 from cups import Connection
-from cups_notify import Subscriber
 
+from .cups_client import CupsClient
+from .notifications import NotificationListener
+from .printer_group import PrinterGroup
 
-cups = Connection()
-notifier = Subscriber(cups)
 
-printer = os.getenv('PRINTER')
+connection_factory = Connection
+printer_names = [name.strip()
+                 for name in os.getenv('PRINTERS', os.getenv('PRINTER', '')).split(',')
+                 if name.strip()]
+
+if os.getenv('CUPS_FAKE', '0') == '1':
+    # Simulate the printers in memory, e.g. for benchmarks
+    from .fakes import FakeCupsServer
+
+    printer_names = printer_names or ['Fake-Printer']
+    pages_per_minute = os.getenv('CUPS_FAKE_PAGES_PER_MINUTE')
+    fake_server = FakeCupsServer(printer_names,
+                                 pages_per_minute and float(pages_per_minute))
+    connection_factory = fake_server.connect
+
+cups = CupsClient(
+    connection_factory,
+    size=int(os.getenv('CUPS_POOL_SIZE', '4')),
+    timeout=float(os.getenv('CUPS_TIMEOUT', '10')),
+    retries=int(os.getenv('CUPS_RETRIES', '2')),
+)
+# The listener holds its own connection since it polls continuously
+notifier = NotificationListener(
+    connection_factory,
+    wait_interval=float(os.getenv('CUPS_NOTIFY_INTERVAL', '0.5')),
+    idle_interval=float(os.getenv('CUPS_NOTIFY_IDLE_INTERVAL', '5')),
+)
+
+printers = PrinterGroup(cups, printer_names)
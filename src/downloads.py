@@ -0,0 +1,79 @@
+import os
+from typing import BinaryIO, Optional
+from urllib.parse import quote, urlsplit, urlunsplit
+from urllib.request import urlopen
+
+from telegram import File
+
+# The address of a self-hosted Bot API server, e.g. http://localhost:8081
+BOT_API_URL = os.getenv('BOT_API_URL')
+# Where the server's working directory (its --dir) is mounted here, if it runs elsewhere
+BOT_API_SERVER_DIR = os.getenv('BOT_API_SERVER_DIR')
+BOT_API_LOCAL_DIR = os.getenv('BOT_API_LOCAL_DIR')
+
+if BOT_API_URL:
+    BASE_URL = f'{BOT_API_URL.rstrip("/")}/bot'
+    BASE_FILE_URL = f'{BOT_API_URL.rstrip("/")}/file/bot'
+    MAX_DOWNLOAD_SIZE_MB = int(os.getenv('LOCAL_MAX_DOWNLOAD_SIZE_MB', '200'))
+else:
+    BASE_URL = None
+    BASE_FILE_URL = None
+    # The limit of the cloud Bot API
+    MAX_DOWNLOAD_SIZE_MB = 20
+MAX_DOWNLOAD_SIZE = MAX_DOWNLOAD_SIZE_MB * 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+
+class FileTooBig(Exception):
+    '''Raised when the downloaded file turns out to be larger than allowed.'''
+
+
+def copy_limited(source: BinaryIO, out: BinaryIO):
+    '''Copy the file in chunks, giving up once it exceeds the size limit.'''
+    copied = 0
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+        copied += len(chunk)
+        if copied > MAX_DOWNLOAD_SIZE:
+            raise FileTooBig(copied)
+        out.write(chunk)
+
+
+def get_local_path(file: File) -> Optional[str]:
+    '''Return the path to the file if a local Bot API server stored it where we can read it.'''
+    path = file.file_path
+    if not path or not os.path.isabs(path):
+        return None
+    if BOT_API_SERVER_DIR and BOT_API_LOCAL_DIR and path.startswith(BOT_API_SERVER_DIR):
+        path = os.path.join(BOT_API_LOCAL_DIR, os.path.relpath(path, BOT_API_SERVER_DIR))
+    return path if os.path.isfile(path) else None
+
+
+def get_url(file: File) -> str:
+    '''Return the URL to download the file from.'''
+    url = file.file_path
+    if os.path.isabs(url):
+        # The server runs in local mode, but its files aren't available here,
+        #   so they have to be served over HTTP, e.g. by a reverse proxy in front of it
+        if BOT_API_SERVER_DIR:
+            url = os.path.relpath(url, os.path.join(BOT_API_SERVER_DIR, file.bot.token))
+        url = f'{file.bot.base_file_url}/{url.lstrip("/")}'
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=quote(parts.path)))
+
+
+def download(file: File, out: BinaryIO):
+    '''Save the file into `out` without ever holding all of it in memory:
+       read it directly from the Bot API server's directory when it's available,
+       stream it over HTTP otherwise.'''
+    local_path = get_local_path(file)
+    if local_path is not None:
+        with open(local_path, 'rb') as source:
+            copy_limited(source, out)
+    else:
+        with urlopen(get_url(file), timeout=DOWNLOAD_TIMEOUT) as response:
+            copy_limited(response, out)
+
+    out.flush()
+    out.seek(0)
@@ -0,0 +1,288 @@
+import os
+import time
+from collections import defaultdict
+from itertools import count
+from math import ceil
+from threading import Condition, Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+from cups import IPPError
+from PyPDF4 import PdfFileReader
+
+# The IPP status CUPS reports for missing objects
+IPP_NOT_FOUND = 0x0406
+
+
+class FakeNotifierConnection:
+    '''An in-memory stand-in for the subscription calls of `cups.Connection`.'''
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.subscriptions: Dict[int, List[str]] = {}
+        self.leases: Dict[int, float] = {}
+        self.events: List[dict] = []
+        self.sequence = count(1)
+        self.subscription_ids = count(1)
+        self.lock = Lock()
+
+    def up_time(self) -> int:
+        '''Return the amount of seconds since the fake server started.'''
+        return int(time.monotonic() - self.started_at)
+
+    def createSubscription(self, _uri: str, events=(), lease_duration: int = -1, **_kwargs) -> int:
+        '''Register a pull subscription for the given events.'''
+        with self.lock:
+            subscription_id = next(self.subscription_ids)
+            self.subscriptions[subscription_id] = list(events)
+            self.leases[subscription_id] = time.monotonic() + lease_duration
+            return subscription_id
+
+    def renewSubscription(self, subscription_id: int, lease_duration: int = -1):
+        '''Extend the lease of the subscription.'''
+        with self.lock:
+            self.leases[subscription_id] = time.monotonic() + lease_duration
+
+    def cancelSubscription(self, subscription_id: int):
+        '''Drop the subscription and its pending events.'''
+        with self.lock:
+            self.subscriptions.pop(subscription_id, None)
+            self.leases.pop(subscription_id, None)
+            self.events = [event for event in self.events
+                           if event['notify-subscription-id'] != subscription_id]
+
+    def getNotifications(self, subscription_ids: List[int],
+                         sequence_numbers: Optional[List[int]] = None) -> dict:
+        '''Return the events of the subscriptions starting from the given sequence numbers.'''
+        if sequence_numbers is None:
+            sequence_numbers = [1] * len(subscription_ids)
+        lowest = dict(zip(subscription_ids, sequence_numbers))
+
+        with self.lock:
+            events = [
+                event for event in self.events
+                if event['notify-subscription-id'] in lowest
+                and event['notify-sequence-number'] >= lowest[event['notify-subscription-id']]
+            ]
+            return {
+                'notify-get-interval': 1,
+                'printer-up-time': self.up_time(),
+                'events': events,
+            }
+
+    def emit(self, event: str, job_index: int, job_name: str, job_state: int, text: str = ''):
+        '''Queue an event for every subscription that is interested in it.'''
+        with self.lock:
+            now = time.monotonic()
+            for subscription_id, events in self.subscriptions.items():
+                if event not in events or self.leases[subscription_id] < now:
+                    continue
+                self.events.append({
+                    'notify-subscription-id': subscription_id,
+                    'notify-sequence-number': next(self.sequence),
+                    'notify-subscribed-event': event,
+                    'notify-text': text,
+                    'notify-job-id': job_index,
+                    'job-name': job_name,
+                    'job-state': job_state,
+                    'printer-up-time': self.up_time(),
+                })
+
+
+class FakeCupsServer(FakeNotifierConnection):
+    '''An in-memory CUPS server whose printers finish every job right away
+       or print `pages_per_minute` pages each, one job at a time.'''
+
+    def __init__(self, printer_names: List[str], pages_per_minute: Optional[float] = None):
+        super().__init__()
+        self.printer_names = printer_names
+        self.pages_per_minute = pages_per_minute
+        self.jobs: Dict[int, dict] = {}
+        self.job_indices = count(1)
+        self.printed_pages = 0
+        self.changed = Condition(self.lock)
+
+        if pages_per_minute:
+            for name in printer_names:
+                Thread(target=self.run_printer, args=(name,), daemon=True).start()
+
+    def connect(self) -> 'FakeCupsServer':
+        '''Return a connection to the server, which is the server itself.'''
+        return self
+
+    def getPrinterAttributes(self, _name: str,
+                             requested_attributes=(),  # pylint: disable=unused-argument
+                             **_kwargs) -> dict:
+        '''Describe a capable, idle printer.'''
+        return {
+            'copies-supported': (1, 999),
+            'number-up-supported': [1, 2, 4, 6, 9, 16],
+            'sides-supported': ['one-sided', 'two-sided-long-edge', 'two-sided-short-edge'],
+            'printer-state': 3,
+            'printer-is-accepting-jobs': True,
+            'printer-resolution-default': (600, 600, 3),
+            'print-quality-supported': [3, 4, 5],
+            'print-color-mode-supported': ['monochrome', 'color'],
+        }
+
+    def getPPD(self, name: str) -> str:
+        '''Act like a driverless printer, which has no PPD.'''
+        raise IPPError(IPP_NOT_FOUND, f'{name} has no PPD')
+
+    def printFile(self, printer: str, filename: str, title: str, options: Dict[str, str]) -> int:
+        '''Accept a job, printing it right away if the printers are instant.'''
+        impressions = count_impressions(filename, options)
+        with self.lock:
+            job_index = next(self.job_indices)
+            self.jobs[job_index] = {
+                'job-printer-uri': f'ipp://localhost/printers/{printer}',
+                'job-name': title,
+                'job-state': 3,
+                'job-impressions': impressions,
+                'job-impressions-completed': 0,
+                'number-up': int(options.get('number-up', 1)),
+                'sides': options.get('sides', 'one-sided'),
+            }
+            self.changed.notify_all()
+
+        if not self.pages_per_minute:
+            self.start(job_index)
+            self.finish(job_index, 9)
+        return job_index
+
+    def run_printer(self, name: str):
+        '''Print the jobs sent to the printer in order, at its speed.'''
+        uri = f'ipp://localhost/printers/{name}'
+        while True:
+            with self.changed:
+                pending = [job_index for job_index, job in self.jobs.items()
+                           if job['job-printer-uri'] == uri and job['job-state'] == 3]
+                if not pending:
+                    self.changed.wait()
+                    continue
+                job_index = min(pending)
+
+            self.start(job_index)
+            while True:
+                time.sleep(60 / self.pages_per_minute)
+                with self.lock:
+                    job = self.jobs.get(job_index)
+                    if job is None:
+                        # Cancelled
+                        break
+                    job['job-impressions-completed'] += 1
+                    self.printed_pages += 1
+                    done = job['job-impressions-completed'] >= job['job-impressions']
+                if done:
+                    self.finish(job_index, 9)
+                    break
+
+    def start(self, job_index: int):
+        '''Start printing the job.'''
+        with self.lock:
+            job = self.jobs[job_index]
+            job['job-state'] = 5
+        self.emit('job-state-changed', job_index, job['job-name'], 5, 'Job printing.')
+
+    def finish(self, job_index: int, job_state: int):
+        '''Move the job to a final state, emitting the events CUPS would.'''
+        with self.lock:
+            job = self.jobs.pop(job_index, None)
+        if job is None:
+            return
+        self.emit('job-completed', job_index, job['job-name'], job_state, 'Job completed.')
+
+    def getJobs(self, which_jobs: str = 'not-completed',  # pylint: disable=unused-argument
+                **_kwargs) -> Dict[int, dict]:
+        '''Return the jobs that are not finished yet.'''
+        with self.lock:
+            return {job_index: dict(job) for job_index, job in self.jobs.items()}
+
+    def cancelJob(self, job_index: int, purge_job: bool = False):  # pylint: disable=unused-argument
+        '''Cancel the job if it isn't finished yet.'''
+        self.finish(job_index, 7)
+
+    def moveJob(self, job_id: int, job_printer_uri: str, **_kwargs):
+        '''Move the job to another printer.'''
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id]['job-printer-uri'] = job_printer_uri
+                self.changed.notify_all()
+
+
+def count_impressions(filename: str, options: Dict[str, str]) -> int:
+    '''Return the amount of printed sides the job takes.'''
+    with open(filename, 'rb') as file:
+        pages = PdfFileReader(file).numPages
+    if options.get('page-ranges'):
+        pages = 0
+        for page_range in options['page-ranges'].split(','):
+            first, _dash, last = page_range.partition('-')
+            pages += int(last or first) - int(first) + 1
+    return ceil(pages / int(options.get('number-up', 1))) * int(options.get('copies', 1))
+
+
+class FakeTelegram:
+    '''An in-memory Bot API standing in for the `Request` of a `telegram.Bot`,
+       which serves the documents from local files.'''
+
+    def __init__(self, document_path: str, latency: float = 0.0):
+        self.document_path = document_path
+        self.latency = latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.markups: Dict[int, str] = {}
+        self.documents: Dict[str, str] = {}
+        # The markup of the first reply to a message, by the chat and the message ID
+        self.replies: Dict[Tuple[int, int], str] = {}
+        self.message_ids = count(1)
+        self.lock = Lock()
+
+    def message(self, data: dict) -> dict:
+        '''Return a message like the one the Bot API would send back.'''
+        with self.lock:
+            message_id = data.get('message_id') or next(self.message_ids)
+            if data.get('reply_markup') is not None:
+                self.markups[data['chat_id']] = data['reply_markup']
+                if data.get('reply_to_message_id') is not None:
+                    self.replies.setdefault((data['chat_id'], data['reply_to_message_id']),
+                                            data['reply_markup'])
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': data['chat_id'], 'type': 'private'},
+            'text': data.get('text', ''),
+        }
+
+    def post(self, url: str, data: dict, timeout: float = None):  # pylint: disable=unused-argument
+        '''Answer a Bot API method call.'''
+        method = url.rsplit('/', 1)[-1]
+        with self.lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Printer', 'username': 'printer_bot'}
+        if method == 'getFile':
+            path = self.documents.get(data['file_id'], self.document_path)
+            return {
+                'file_id': data['file_id'],
+                'file_unique_id': data['file_id'],
+                'file_size': os.path.getsize(path),
+                'file_path': os.path.abspath(path),
+            }
+        if method == 'getMyCommands':
+            return []
+        if method == 'sendMediaGroup':
+            return [self.message(data) for _media in data['media']]
+        if method.startswith('send') or method.startswith('edit'):
+            return self.message(data)
+        return True
+
+    def retrieve(self, _url: str,
+                 timeout: float = None) -> bytes:  # pylint: disable=unused-argument
+        '''Return the contents of the document.'''
+        with open(self.document_path, 'rb') as file:
+            return file.read()
+
+    def stop(self):
+        '''Nothing to clean up, unlike in a real `Request`.'''
@@ -0,0 +1,230 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from collections.abc import MutableMapping
+from threading import RLock, local
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    holder TEXT,
+    lease_owner TEXT,
+    lease_expires REAL
+);
+CREATE TABLE IF NOT EXISTS previews (
+    content_hash TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL
+);
+'''
+
+# Stays the same across restarts, so that a worker gets back the jobs it held.
+#   Workers sharing a host need a WORKER_ID each.
+WORKER_ID = os.getenv('WORKER_ID', socket.gethostname())
+
+
+class JobBusy(Exception):
+    '''Raised when another worker is acting on the job.'''
+
+
+class JobStore:
+    '''A durable table of print job records in SQLite, shareable between worker processes.
+
+       Each record remembers the worker that last wrote it (the holder).
+       Workers take short leases on jobs so that two of them never act on the same job.'''
+
+    def __init__(self, filename: str):
+        self.lock = RLock()
+        self.connection = sqlite3.connect(filename, timeout=10, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (('holder', 'TEXT'),
+                                    ('lease_owner', 'TEXT'),
+                                    ('lease_expires', 'REAL')):
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+    def save(self, record: dict, holder: str):
+        '''Insert or update the record of a job.'''
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO jobs (id, state, record, holder) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET '
+                'state = excluded.state, record = excluded.record, holder = excluded.holder',
+                (record['id'], record['state'], json.dumps(record, separators=(',', ':')), holder),
+            )
+
+    def delete(self, job_id: str):
+        '''Forget the job.'''
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def ids(self, holder: str = None) -> List[str]:
+        '''Return the IDs of the stored jobs, or only of those of the holder.'''
+        with self.lock:
+            if holder is None:
+                rows = self.connection.execute('SELECT id FROM jobs')
+            else:
+                rows = self.connection.execute('SELECT id FROM jobs WHERE holder = ?', (holder,))
+            return [row[0] for row in rows]
+
+    def load_all(self) -> List[Tuple[dict, Optional[str]]]:
+        '''Return the records of all the stored jobs along with their holders.'''
+        with self.lock:
+            rows = self.connection.execute('SELECT record, holder FROM jobs').fetchall()
+        return [(json.loads(record), holder) for record, holder in rows]
+
+    def acquire(self, job_id: str, owner: str, ttl: float) -> dict:
+        '''Lease the job to the owner and return its current record.
+           Raise `KeyError` if there's no such job and `JobBusy` if it's leased by someone else.'''
+        now = time.time()
+        with self.lock, self.connection:
+            leased = self.connection.execute(
+                'UPDATE jobs SET lease_owner = ?, lease_expires = ? WHERE id = ? '
+                'AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)',
+                (owner, now + ttl, job_id, owner, now),
+            ).rowcount
+            row = self.connection.execute(
+                'SELECT record FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+
+        if row is None:
+            raise KeyError(job_id)
+        if not leased:
+            raise JobBusy(job_id)
+        return json.loads(row[0])
+
+    def get_preview(self, content_hash: str) -> Optional[str]:
+        '''Return the Telegram file ID of an already uploaded file with this content.'''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT file_id FROM previews WHERE content_hash = ?', (content_hash,)
+            ).fetchone()
+        return row and row[0]
+
+    def save_preview(self, content_hash: str, file_id: str):
+        '''Remember the Telegram file ID of an uploaded file with this content.'''
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO previews (content_hash, file_id) VALUES (?, ?)',
+                (content_hash, file_id),
+            )
+
+    def release(self, job_ids: List[str], owner: str):
+        '''Give up the owner's leases on the jobs.'''
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'UPDATE jobs SET lease_owner = NULL WHERE id = ? AND lease_owner = ?',
+                [(job_id, owner) for job_id in job_ids],
+            )
+
+
+class JobRegistry(MutableMapping):
+    '''A mapping of job IDs to print jobs that is backed by a `JobStore`.
+
+       Accessing a job leases it to this worker until the next `flush` from the same thread
+       and picks up the changes other workers made to it.
+       The jobs this worker held before a restart are restored and resumed on first access.
+       Iterating goes over the jobs this worker holds, not those of the other workers.
+       Changes are written by `flush`, which only saves the jobs whose records changed.'''
+
+    def __init__(self,
+                 store: JobStore,
+                 restore: Callable[[dict], Optional[object]],
+                 resume: Callable[[object], None],
+                 owner: str = WORKER_ID,
+                 lease_ttl: float = 30):
+        self.store = store
+        self.restore = restore
+        self.resume = resume
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.jobs: Optional[Dict[str, object]] = None
+        self.saved: Dict[str, dict] = {}
+        self.lock = RLock()
+        self.leases = local()
+
+    def load(self) -> Dict[str, object]:
+        '''Restore this worker's stored jobs unless that has been done already.'''
+        with self.lock:
+            if self.jobs is None:
+                self.jobs = {}
+                for record, holder in self.store.load_all():
+                    if holder != self.owner:
+                        continue
+                    job = self.restore(record)
+                    if job is None:
+                        self.store.delete(record['id'])
+                    else:
+                        self.jobs[record['id']] = job
+                        self.saved[record['id']] = record
+                        self.resume(job)
+            return self.jobs
+
+    def leased(self) -> set:
+        '''Return the IDs of the jobs leased by the current thread.'''
+        if not hasattr(self.leases, 'ids'):
+            self.leases.ids = set()
+        return self.leases.ids
+
+    def __getitem__(self, job_id: str):
+        with self.lock:
+            jobs = self.load()
+            record = self.store.acquire(job_id, self.owner, self.lease_ttl)
+            self.leased().add(job_id)
+
+            job = jobs.get(job_id)
+            if job is None:
+                job = self.restore(record)
+                if job is None:
+                    raise KeyError(job_id)
+                jobs[job_id] = job
+            elif self.saved.get(job_id) != record:
+                # Another worker changed the job since we last saw it
+                job.apply_record(record)
+            self.saved[job_id] = record
+            return job
+
+    def __setitem__(self, job_id: str, job):
+        with self.lock:
+            self.load()[job_id] = job
+            self.save(job)
+            self.store.acquire(job_id, self.owner, self.lease_ttl)
+            self.leased().add(job_id)
+
+    def __delitem__(self, job_id: str):
+        with self.lock:
+            self.load().pop(job_id, None)
+            self.saved.pop(job_id, None)
+            self.leased().discard(job_id)
+            self.store.delete(job_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.ids(self.owner))
+
+    def __len__(self) -> int:
+        return len(self.store.ids(self.owner))
+
+    def save(self, job):
+        '''Write the job's record if it changed since the last write.'''
+        record = job.to_record()
+        with self.lock:
+            if self.saved.get(job.id) != record:
+                self.store.save(record, self.owner)
+                self.saved[job.id] = record
+
+    def flush(self):
+        '''Write the records of all the jobs that changed and release the thread's leases.'''
+        with self.lock:
+            if self.jobs is None:
+                return
+            for job in list(self.jobs.values()):
+                self.save(job)
+            self.store.release(list(self.leased()), self.owner)
+            self.leased().clear()
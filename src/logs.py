@@ -0,0 +1,30 @@
+import logging
+
+
+class BraceMessage:
+    '''A log message with `str.format` fields, formatted only if the record is emitted.'''
+    __slots__ = ('format', 'args')
+
+    def __init__(self, format: str, args: tuple):
+        self.format = format
+        self.args = args
+
+    def __str__(self) -> str:
+        return self.format.format(*self.args)
+
+
+class BraceLogger(logging.LoggerAdapter):
+    '''A logger that takes the arguments of its messages in `{}` fields instead of `%s`.'''
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger, {})
+
+    def log(self, level: int, msg: str, *args, **kwargs):
+        if self.isEnabledFor(level):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger.log(level, BraceMessage(msg, args), **kwargs)
+
+
+def get_logger(name: str) -> BraceLogger:
+    '''Return the logger of the module, with `{}`-style messages like the linter expects.'''
+    return BraceLogger(logging.getLogger(name))
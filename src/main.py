@@ -1,38 +1,67 @@
 import os
-import re
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import wait
+from datetime import timedelta
+from math import ceil
 from secrets import compare_digest
-from tempfile import NamedTemporaryFile
+from typing import Tuple
 
-from cups_notify.event import CupsEvent, CUPS_EVT_JOB_STATE_CHANGED
-from telegram import Update, ParseMode
+from telegram import Message, Update, ParseMode
 from telegram.ext import (
     CallbackContext,
     CommandHandler,
     MessageHandler,
-    PicklePersistence,
+    TypeHandler,
     Updater,
 )
 from telegram.ext.filters import Filters
 
 from .actions.no_title import no_title_handler
+from .actions.page_preview import page_preview_handler
 from .actions.parse_caption import parse_caption_handler
 from .actions.print import print_handler, cancel_handler
 from .actions.preview import preview_handler
-from .cups_server import notifier
+from .admission import QueueFull, conversion_limiter, conversions, upload_limiter
+from .cups_server import cups, notifier, printers
+from .downloads import (
+    BASE_FILE_URL,
+    BASE_URL,
+    MAX_DOWNLOAD_SIZE,
+    MAX_DOWNLOAD_SIZE_MB,
+    FileTooBig,
+    download,
+)
+from .job_store import JobBusy, JobRegistry, JobStore
+from .logs import get_logger
+from .metrics import stage_seconds
+from .notifications import (
+    JobEvent,
+    EVT_JOB_COMPLETED,
+    EVT_JOB_STATE_CHANGED,
+    JOB_STATE_PROCESSING,
+)
 from .options.pages import pages_handler
 from .options.copies import copies_handler
 from .options.advanced import advanced_handler
 from .print_job import PrintJob
-from .utils import convert_to_pdf
+from .profiling import ENABLED as PROFILE_UPDATES, install as install_profiling
+from .quality import DEFAULT_PRESET, get_preset, presets
+from .scheduler import scheduler
+from .spool import SpoolFile
+from .sqlite_persistence import SQLitePersistence
+from .traces import RECORD_TRACE, TraceRecorder
+from .utils import convert_to_pdf, merge_pdfs
+from .work import Cancelled, WorkHandle
 
 
 AUTH_TOKEN = os.getenv('AUTH_TOKEN')
 
-MAX_DOWNLOAD_SIZE_MB = 20
-MAX_DOWNLOAD_SIZE = MAX_DOWNLOAD_SIZE_MB * 1024 * 1024
-job_started_desc = re.compile('Job #\\d+ started.')
-job_processing_title = re.compile('Print Job: [^(]+\\(([0-9a-f]+)\\) processing')
+# How long to wait for the rest of an album after its first document arrives
+BATCH_DELAY = 1.5
+BUSY_TEXT = ('Sorry, I have too many files to go through right now. '
+             'Please try again in a few minutes.')
+
+logger = get_logger(__name__)
 
 
 def authenticate(update: Update, context: CallbackContext):
@@ -52,13 +81,13 @@ def authenticate(update: Update, context: CallbackContext):
             'Greetings! Send me any files you want to print and, with any luck, '
             'they\'ll soon be awaiting you at the student printer (5th floor).'
         )
-        # update.message.reply_text(
-        #     'You\'ll notice that toner save is on by default. '
-        #     'This just means that the printed text is lighter than regular, '
-        #     'but still very readable. You can turn it off for some documents specifically '
-        #     'or turn off by default with the /toner_save command.\n'
-        #     'Consider using it for non-critical printing~'
-        # )
+        if 'draft' in presets:
+            update.message.reply_text(
+                'For non-critical printing, consider the fast draft mode: '
+                'it prints quicker and saves toner, and the text is still very readable. '
+                'You can turn it on for some documents specifically in the advanced settings '
+                'or by default with the /quality command.'
+            )
 
 
 def process_file(update: Update, context: CallbackContext):
@@ -74,75 +103,380 @@ def process_file(update: Update, context: CallbackContext):
         update.message.reply_text(f'Sorry, I only work with files up to {MAX_DOWNLOAD_SIZE_MB} MB')
         return
 
-    file = update.message.document.get_file()
-    container = NamedTemporaryFile()
-    file.download(out=container)
-    container.original_name = update.message.document.file_name
+    if not admit(update.message, update.effective_user.id):
+        return
+
+    if update.message.media_group_id is not None:
+        batches = context.bot_data.setdefault('batches', {})
+        if update.message.media_group_id not in batches:
+            batches[update.message.media_group_id] = {
+                'messages': [],
+                'user_id': update.effective_user.id,
+                'quality': context.user_data.get('quality', DEFAULT_PRESET),
+                'work': WorkHandle(),
+            }
+            context.job_queue.run_once(process_batch,
+                                       BATCH_DELAY,
+                                       context=update.message.media_group_id)
+        batch = batches[update.message.media_group_id]
+        batch['messages'].append(update.message)
+        return
+
+    work = WorkHandle()
+    try:
+        future, position = conversions.submit(process_document,
+                                              update,
+                                              context,
+                                              context.user_data.get('quality', DEFAULT_PRESET),
+                                              work)
+    except QueueFull:
+        update.message.reply_text(BUSY_TEXT)
+        return
+    work.attach(future)
+    track_upload(context, update.message, update.effective_user.id, work)
+    if position > 0:
+        update.message.reply_text(queued_text(position))
+
+
+def admit(message: Message, user_id: int) -> bool:
+    '''Check the user's upload and conversion allowance, telling them to wait if it's used up.'''
+    allowed, wait_time = upload_limiter.allow(user_id)
+    if allowed and message.document.mime_type != 'application/pdf':
+        allowed, wait_time = conversion_limiter.allow(user_id)
+    if not allowed:
+        message.reply_text(
+            'You are sending files faster than I can handle them. '
+            f'Please send this one again in {ceil(wait_time)} s.'
+        )
+    return allowed
+
+
+def track_upload(context: CallbackContext, message: Message, user_id: int, work: WorkHandle):
+    '''Remember the work on the document once it's admitted to the conversion queue,
+       replacing the user's previous upload of the same file: its conversion is stopped
+       and its job is cancelled unless it was submitted already.'''
+    uploads = context.bot_data.setdefault('uploads', {})
+    key = (user_id, message.document.file_unique_id)
+    previous = uploads.get(key)
+    uploads[key] = work
+    if previous is None or previous is work:
+        return
+
+    if previous.job_id is None:
+        previous.cancel()
+        return
+    jobs = context.bot_data['jobs']
+    try:
+        job = jobs.get(previous.job_id)
+        if job is not None and job.state == PrintJob.STATE_PREPARING:
+            jobs.pop(previous.job_id).cancel()
+    except JobBusy:
+        # Someone is working with the job, leave it be
+        pass
+
+
+def queued_text(position: int) -> str:
+    '''Return the reply for a document that is waiting for a conversion worker.'''
+    return (f'I\'m busy with other files right now, yours is queued as #{position}. '
+            'I\'ll reply when it\'s ready.')
 
-    converted = convert_to_pdf(container, update.message.document.mime_type)
 
-    job = PrintJob(container,
+def process_document(update: Update, context: CallbackContext, quality: str, work: WorkHandle):
+    '''Set up a print job for a single document, in a conversion worker.'''
+    try:
+        container, converted = download_document(update.message, work)
+        create_job(context,
+                   update.message,
+                   container,
                    converted,
                    update.message.caption,
-                   toner_save=context.user_data.get('toner_save', True))
-    context.bot_data.setdefault('jobs', {})[job.id] = job
+                   update.effective_user.id,
+                   quality,
+                   work)
+        save_jobs(context)
+    except Cancelled:
+        pass
+    except Exception as error:  # pylint: disable=broad-except
+        context.dispatcher.dispatch_error(update, error)
+
+
+def process_batch(context: CallbackContext):
+    '''Set up a single print job for all the documents of an album.'''
+    batch = context.bot_data['batches'].pop(context.job.context)
+    messages = sorted(batch['messages'], key=lambda message: message.message_id)
+    work = batch['work']
+
+    futures = []
+    try:
+        for message in messages:
+            future, position = conversions.submit(download_document, message, work)
+            work.attach(future)
+            if not futures and position > 0:
+                messages[0].reply_text(queued_text(position))
+            futures.append(future)
+    except QueueFull:
+        work.cancel()
+        messages[0].reply_text(BUSY_TEXT)
+    else:
+        for message in messages:
+            track_upload(context, message, batch['user_id'], work)
+    wait(futures)
+
+    parts = []
+    failure = None
+    for message, future in zip(messages, futures):
+        if future.cancelled():
+            continue
+        error = future.exception()
+        if error is None:
+            parts.append(future.result())
+        elif failure is None and not isinstance(error, Cancelled):
+            failure = (message, error)
+
+    if work.cancelled or failure is not None:
+        for part, _converted in parts:
+            part.delete()
+        if failure is not None and not work.cancelled:
+            reply_batch_failure(*failure)
+        return
+
+    container = SpoolFile.create()
+    try:
+        with stage_seconds.labels('merge').time():
+            merge_pdfs([part for part, _converted in parts], container)
+    except Exception as error:  # pylint: disable=broad-except
+        container.delete()
+        reply_batch_failure(messages[0], error)
+        return
+    finally:
+        for part, _converted in parts:
+            part.delete()
+    container.original_name = 'album.pdf'
+
+    create_job(context,
+               messages[0],
+               container,
+               any(converted for _part, converted in parts),
+               next((message.caption for message in messages if message.caption), None),
+               batch['user_id'],
+               batch['quality'],
+               work)
+    save_jobs(context)
+
+
+def reply_batch_failure(message: Message, error: Exception):
+    '''Tell the user that the album can't be printed because of one of its documents.'''
+    if isinstance(error, FileTooBig):
+        message.reply_text(f'Sorry, I only work with files up to {MAX_DOWNLOAD_SIZE_MB} MB, '
+                           'so I can\'t print this album')
+        return
+    logger.error('Could not process an album', exc_info=error)
+    message.reply_text('Sorry, I couldn\'t read this file, so I can\'t print the album')
+
+
+def download_document(message: Message, work: WorkHandle) -> Tuple[SpoolFile, bool]:
+    '''Download the document of the message into the spool and convert it to PDF.
+       Return the file and whether the conversion took place.'''
+    container = SpoolFile.create()
+    try:
+        with stage_seconds.labels('download').time():
+            download(message.document.get_file(), work.wrap(container))
+        container.original_name = message.document.file_name
+
+        with stage_seconds.labels('convert').time():
+            return container, convert_to_pdf(container, message.document.mime_type, work)
+    except Exception:
+        container.delete()
+        raise
+
 
-    job.status_message = update.message.reply_text(
+def create_job(context: CallbackContext,  # pylint: disable=too-many-arguments
+               message: Message,
+               container: SpoolFile,
+               converted: bool,
+               caption: str,
+               user_id: int,
+               quality: str,
+               work: WorkHandle):
+    '''Set up a print job for the file and reply to the message with its status.'''
+    if work.cancelled:
+        container.delete()
+        raise Cancelled()
+    with stage_seconds.labels('parse').time():
+        job = PrintJob(container, converted, caption, user_id, quality=quality, work=work)
+
+    job.set_status_message(message.reply_text(
         job.get_message_text(),
         parse_mode=ParseMode.HTML,
-        reply_to_message_id=update.message.message_id,
+        reply_to_message_id=message.message_id,
         reply_markup=job.get_keyboard(),
-    )
+    ))
+    context.bot_data['jobs'][job.id] = job
 
 
-def toggle_toner_save(update: Update, context: CallbackContext):
-    '''Toggle the default setting for toner save mode.'''
-    context.user_data['toner_save'] = not context.user_data.get('toner_save', True)
-    if context.user_data['toner_save']:
-        update.message.reply_text(
-            'Toner save enabled by default! To turn it off, use the /toner_save command again.\n'
-        )
-    else:
+def set_default_quality(update: Update, context: CallbackContext):
+    '''Set the print quality preset that new jobs start with.'''
+    if context.args and context.args[0] in presets:
+        context.user_data['quality'] = context.args[0]
         update.message.reply_text(
-            'Toner save disabled by default! To turn it on, use the /toner_save command again.\n'
+            f'New jobs will be printed in {presets[context.args[0]].title.lower()} quality '
+            'by default. You can still change it for some documents in the advanced settings.'
         )
+        return
+
+    current = get_preset(context.user_data.get('quality', DEFAULT_PRESET))
+    update.message.reply_text(
+        f'New jobs are printed in {current.title.lower()} quality by default. '
+        'To change that, use one of these commands:\n'
+        + '\n'.join(f'/quality {preset.key} — {preset.title}' for preset in presets.values())
+    )
 
 
-def monitor_job_creation(event: CupsEvent):
+def monitor_job_creation(event: JobEvent):
     '''A listener callback to mark print jobs as started.'''
-    if job_started_desc.fullmatch(event.description) is not None:
-        match = job_processing_title.fullmatch(event.title)
-        if match is not None:
-            job_id = match.group(1)
-            updater.job_queue.run_once(mark_job_sent, when=0, context=job_id)
+    if event.job_state == JOB_STATE_PROCESSING and event.job_name:
+        updater.job_queue.run_once(mark_job_sent, when=0, context=event.job_name)
+
+
+def monitor_job_completion(event: JobEvent):
+    '''A listener callback to let more jobs through when the printer frees up.'''
+    updater.job_queue.run_once(release_jobs, when=0)
+    if event.job_name:
+        updater.job_queue.run_once(record_completion, when=0, context=event.job_name)
+
+
+def record_completion(context: CallbackContext):
+    '''Log how long CUPS took to print the job and how much the print file was optimized.'''
+    job = context.bot_data['jobs'].get(context.job.context)
+    if job is None or job.submitted_at is None:
+        save_jobs(context)
+        return
+
+    logger.info('Job {} was processed by CUPS in {:.1f} s, print file size {} -> {} bytes',
+                job.id,
+                time.time() - job.submitted_at,
+                job.size_before_optimization,
+                job.size_after_optimization)
+    save_jobs(context)
+
+
+def release_jobs(context: CallbackContext):
+    '''Send the held jobs to the printer if it has room for them.'''
+    # Restores the stored jobs, putting the held ones back in line
+    context.bot_data['jobs'].load()
+    scheduler.release()
 
 
 def clean_up(context: CallbackContext):
-    '''Expire the jobs that were created more than an hour ago.'''
-    time_limit = datetime.now() - timedelta(hours=1)
-    jobs = context.bot_data.get('jobs', {})
+    '''Expire the jobs that were created more than an hour ago unless they are still being sent,
+       forget the rate limits of the users who are idle and the uploads that can no longer
+       be replaced.'''
+    time_limit = time.time() - timedelta(hours=1).total_seconds()
+    jobs = context.bot_data['jobs']
     expired_ids = []
     for job_id in jobs.keys():
-        if jobs[job_id].created_at < time_limit:
-            jobs[job_id].expire()
+        try:
+            job = jobs[job_id]
+        except JobBusy:
+            # Another worker is acting on the job, it's expired on the next run
+            continue
+        except KeyError:
+            # The job can no longer be restored, e.g. its file is gone
+            expired_ids.append(job_id)
+            continue
+        if job.created_at < time_limit and not job.streaming:
+            job.expire()
             expired_ids.append(job_id)
     for job_id in expired_ids:
-        jobs.pop(job_id)
+        del jobs[job_id]
+    save_jobs(context)
+    uploads = context.bot_data.get('uploads', {})
+    for key, work in list(uploads.items()):
+        if work.cancelled or (work.job_id is None and work.futures
+                              and all(future.done() for future in work.futures)):
+            # Expired or failed, there is nothing to replace
+            uploads.pop(key)
+    upload_limiter.forget_idle()
+    conversion_limiter.forget_idle()
+
+
+def save_jobs(context: CallbackContext):
+    '''Write the changes of the print jobs to the job store.'''
+    context.bot_data['jobs'].flush()
+
+
+def commit_persistence(_context: CallbackContext):
+    '''Commit the user and conversation data that is still waiting for its batch to fill up.'''
+    persistence.commit_pending()
+
+
+def save_jobs_after_update(_update: object, context: CallbackContext):
+    '''Write the changes that handling an update made to the print jobs.'''
+    save_jobs(context)
+
+
+def handle_error(update: object, context: CallbackContext):
+    '''Tell the user to retry if another worker is busy with the job
+       or that the file is too big, log other errors.'''
+    if isinstance(context.error, JobBusy):
+        if isinstance(update, Update) and update.callback_query is not None:
+            update.callback_query.answer('This job is busy, try again in a moment')
+        return
+    if isinstance(context.error, FileTooBig):
+        if isinstance(update, Update) and update.effective_message is not None:
+            update.effective_message.reply_text(
+                f'Sorry, I only work with files up to {MAX_DOWNLOAD_SIZE_MB} MB'
+            )
+        return
+    logger.error('Error while handling an update', exc_info=context.error)
+
+
+def fail_over_printers(_context: CallbackContext):
+    '''Move the queued jobs of the offline printers to the online ones.'''
+    printers.fail_over()
 
 
 def mark_job_sent(context: CallbackContext):
     '''Mark the given job as sent.'''
-    job = context.bot_data['jobs'].get(context.job.context)
-    if job is not None:
+    try:
+        job = context.bot_data['jobs'].get(context.job.context)
+    except JobBusy:
+        # Try again once the other worker is done with the job
+        context.job_queue.run_once(mark_job_sent, when=1, context=context.job.context)
+        return
+    if job is not None and job.state == PrintJob.STATE_WAITING:
         job.set_state(PrintJob.STATE_SENT)
+        save_jobs(context)
 
 
-persistence = PicklePersistence(filename='data.pkl', store_bot_data=False)
-updater = Updater(os.getenv('BOT_API_TOKEN'), persistence=persistence, use_context=True)
+persistence_path = os.getenv('PERSISTENCE_DB', 'data.sqlite3')
+is_new_database = not os.path.exists(persistence_path)
+persistence = SQLitePersistence(filename=persistence_path, store_bot_data=False)
+if is_new_database and os.path.exists('data.pkl'):
+    persistence.import_pickle('data.pkl')
+updater = Updater(os.getenv('BOT_API_TOKEN'),
+                  base_url=BASE_URL,
+                  base_file_url=BASE_FILE_URL,
+                  persistence=persistence,
+                  use_context=True)
+PrintJob.bot = updater.bot
+updater.dispatcher.bot_data['jobs'] = JobRegistry(
+    JobStore(os.getenv('JOB_STORE_DB', 'jobs.sqlite3')),
+    PrintJob.from_record,
+    PrintJob.resume,
+)
+updater.job_queue.run_repeating(save_jobs, timedelta(seconds=5))
+updater.job_queue.run_repeating(commit_persistence,
+                                timedelta(seconds=persistence.commit_interval))
 updater.job_queue.run_repeating(clean_up, timedelta(hours=1))
+updater.job_queue.run_repeating(fail_over_printers, timedelta(minutes=1))
+updater.job_queue.run_repeating(release_jobs, timedelta(seconds=15))
 
+if RECORD_TRACE:
+    updater.dispatcher.add_handler(TypeHandler(Update, TraceRecorder(RECORD_TRACE).record),
+                                   group=-1)
 updater.dispatcher.add_handler(CommandHandler('start', authenticate))
-# updater.dispatcher.add_handler(CommandHandler('toner_save', toggle_toner_save))
+updater.dispatcher.add_handler(CommandHandler('quality', set_default_quality))
 updater.dispatcher.add_handler(MessageHandler(Filters.document, process_file))
 updater.dispatcher.add_handler(pages_handler)
 updater.dispatcher.add_handler(copies_handler)
@@ -150,7 +484,14 @@ updater.dispatcher.add_handler(advanced_handler)
 updater.dispatcher.add_handler(print_handler)
 updater.dispatcher.add_handler(cancel_handler)
 updater.dispatcher.add_handler(preview_handler)
+updater.dispatcher.add_handler(page_preview_handler)
 updater.dispatcher.add_handler(no_title_handler)
 updater.dispatcher.add_handler(parse_caption_handler)
+updater.dispatcher.add_handler(TypeHandler(Update, save_jobs_after_update), group=1)
+updater.dispatcher.add_error_handler(handle_error)
+
+notifier.subscribe(monitor_job_creation, [EVT_JOB_STATE_CHANGED])
+notifier.subscribe(monitor_job_completion, [EVT_JOB_COMPLETED])
 
-notifier.subscribe(monitor_job_creation, [CUPS_EVT_JOB_STATE_CHANGED])
+if PROFILE_UPDATES:
+    install_profiling(updater, cups)
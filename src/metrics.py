@@ -0,0 +1,267 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    '''A thread-safe value that only goes up.'''
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1):
+        '''Add to the value.'''
+        with self.lock:
+            self.value += amount
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        '''Return the (suffix, extra labels, value) triples to expose.'''
+        return [('_total', {}, self.value)]
+
+
+class Gauge:
+    '''A thread-safe value that can go up and down, or be computed when it's collected.'''
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self.lock = Lock()
+
+    def set(self, value: float):
+        '''Replace the value.'''
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount: float = 1):
+        '''Add to the value.'''
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        '''Subtract from the value.'''
+        with self.lock:
+            self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        '''Compute the value with `function` every time it's collected.'''
+        self.function = function
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        '''Return the (suffix, extra labels, value) triples to expose.'''
+        if self.function is not None:
+            try:
+                return [('', {}, self.function())]
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Could not compute a gauge')
+                return []
+        return [('', {}, self.value)]
+
+
+class Histogram:
+    '''A thread-safe cumulative histogram of durations (in seconds).'''
+    kind = 'histogram'
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value: float):
+        '''Record a single measurement.'''
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        '''Measure how long the block takes.'''
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started_at)
+
+    def quantile(self, fraction: float) -> float:
+        '''Estimate a quantile from the bucket bounds (the upper bound of the matching bucket).'''
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            threshold = fraction * self.count
+            seen = 0
+            for idx, amount in enumerate(self.counts):
+                seen += amount
+                if seen >= threshold:
+                    return self.buckets[idx] if idx < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def summary(self) -> Dict[str, float]:
+        '''Return the count, the mean and the estimated p50/p99 of the measurements.'''
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        '''Return the (suffix, extra labels, value) triples to expose.'''
+        with self.lock:
+            samples = []
+            cumulative = 0
+            for bound, amount in zip(self.buckets + (float('inf'),), self.counts):
+                cumulative += amount
+                samples.append(('_bucket', {'le': format_value(bound)}, cumulative))
+            samples.append(('_sum', {}, self.sum))
+            samples.append(('_count', {}, self.count))
+        return samples
+
+
+class Family:
+    '''A named metric with a child of the same kind for every combination of label values.
+
+       A family without labels acts as its only child.'''
+
+    def __init__(self, kind: type, name: str, documentation: str,
+                 label_names: Sequence[str] = (), **kwargs):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.kwargs = kwargs
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self.lock = Lock()
+
+    def labels(self, *values):
+        '''Return the child for the label values, creating it on first use.'''
+        if len(values) != len(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}')
+        values = tuple(str(value) for value in values)
+        with self.lock:
+            child = self.children.get(values)
+            if child is None:
+                child = self.children[values] = self.kind(**self.kwargs)
+            return child
+
+    def __getattr__(self, attribute: str):
+        if attribute.startswith('_') or attribute == 'children':
+            raise AttributeError(attribute)
+        return getattr(self.labels(), attribute)
+
+    def exposition(self) -> List[str]:
+        '''Return the lines of the Prometheus text format for the family.'''
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind.kind}',
+        ]
+        with self.lock:
+            children = list(self.children.items())
+        for values, child in children:
+            for suffix, extra_labels, value in child.samples():
+                labels = dict(zip(self.label_names, values), **extra_labels)
+                label_text = ','.join(
+                    f'{name}="{escape_label(label)}"' for name, label in labels.items()
+                )
+                lines.append(
+                    f'{self.name}{suffix}{{{label_text}}} {format_value(value)}' if label_text
+                    else f'{self.name}{suffix} {format_value(value)}'
+                )
+        return lines
+
+
+class Registry:
+    '''The collection of all the metrics the bot exposes.'''
+
+    def __init__(self):
+        self.families: Dict[str, Family] = {}
+        self.lock = Lock()
+
+    def register(self, family: Family) -> Family:
+        '''Add the family, or return the already registered one with the same name.'''
+        with self.lock:
+            return self.families.setdefault(family.name, family)
+
+    def exposition(self) -> str:
+        '''Return all the metrics in the Prometheus text format.'''
+        with self.lock:
+            families = list(self.families.values())
+        return ''.join(line + '\n' for family in families for line in family.exposition())
+
+
+registry = Registry()
+
+
+def format_value(value: float) -> str:
+    '''Format a number the way Prometheus expects.'''
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value: str) -> str:
+    '''Escape a label value for the text format.'''
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def counter(name: str, documentation: str, label_names: Sequence[str] = ()) -> Family:
+    '''Register a counter.'''
+    return registry.register(Family(Counter, name, documentation, label_names))
+
+
+def gauge(name: str, documentation: str, label_names: Sequence[str] = ()) -> Family:
+    '''Register a gauge.'''
+    return registry.register(Family(Gauge, name, documentation, label_names))
+
+
+def histogram(name: str,
+              documentation: str,
+              label_names: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Family:
+    '''Register a histogram.'''
+    return registry.register(Family(Histogram, name, documentation, label_names,
+                                    buckets=buckets))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''Serve the metrics to Prometheus.'''
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''Respond with the current values of all the metrics.'''
+        body = registry.exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+
+def start_server(port: int, address: str = '127.0.0.1') -> ThreadingHTTPServer:
+    '''Serve the metrics over HTTP from a background thread.'''
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+stage_seconds = histogram('printer_stage_seconds',
+                          'Time spent in each stage of preparing and submitting print jobs',
+                          ['stage'])
@@ -0,0 +1,176 @@
+import time
+from collections import namedtuple
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List
+
+from .logs import get_logger
+from .metrics import counter, histogram
+
+EVT_JOB_CREATED = 'job-created'
+EVT_JOB_STATE_CHANGED = 'job-state-changed'
+EVT_JOB_COMPLETED = 'job-completed'
+EVT_PRINTER_STATE_CHANGED = 'printer-state-changed'
+
+JOB_STATE_PENDING = 3
+JOB_STATE_HELD = 4
+JOB_STATE_PROCESSING = 5
+JOB_STATE_STOPPED = 6
+JOB_STATE_CANCELED = 7
+JOB_STATE_ABORTED = 8
+JOB_STATE_COMPLETED = 9
+
+JobEvent = namedtuple('JobEvent', [
+    'name',
+    'job_index',
+    'job_name',
+    'job_state',
+    'text',
+    'sequence',
+])
+
+events_total = counter('printer_cups_events', 'CUPS notifications received', ['event'])
+
+logger = get_logger(__name__)
+
+
+class NotificationListener:
+    '''Receive CUPS events by pulling them in batches with IPP Get-Notifications.
+
+       Polling happens every `wait_interval` seconds while events are flowing
+       and backs off to `idle_interval` when nothing happens.
+       Call `wake` to poll immediately, e.g. right after submitting a job.
+       Subscription leases are renewed from the polling thread.'''
+
+    def __init__(self,
+                 connection_factory: Callable,
+                 wait_interval: float = 0.5,
+                 idle_interval: float = 5.0,
+                 lease_duration: int = 3600,
+                 uri: str = 'ipp://localhost/'):
+        self.connection_factory = connection_factory
+        self.connection = None
+        self.wait_interval = wait_interval
+        self.idle_interval = idle_interval
+        self.lease_duration = lease_duration
+        self.uri = uri
+        self.latency = histogram('printer_cups_notification_latency_seconds',
+                                 'Time from a CUPS event to its delivery in the bot')
+
+        self.subscriptions: Dict[int, Callable] = {}
+        self.sequence_numbers: Dict[int, int] = {}
+        self.renew_at = 0.0
+        self.lock = Lock()
+        self.woken = Event()
+        self.stopped = Event()
+        self.thread = None
+
+    def subscribe(self, callback: Callable[[JobEvent], None], events: List[str]):
+        '''Call `callback` with every `JobEvent` of the given kinds.'''
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.connection_factory()
+            subscription_id = self.connection.createSubscription(
+                self.uri,
+                events=events,
+                lease_duration=self.lease_duration,
+            )
+            self.subscriptions[subscription_id] = callback
+            self.sequence_numbers[subscription_id] = 1
+            self.renew_at = time.monotonic() + self.lease_duration / 2
+
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = Thread(target=self.run, name='cups-notifications', daemon=True)
+            self.thread.start()
+
+    def unsubscribe_all(self):
+        '''Cancel all subscriptions and stop the polling thread.'''
+        self.stopped.set()
+        self.woken.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        with self.lock:
+            for subscription_id in self.subscriptions:
+                self.connection.cancelSubscription(subscription_id)
+            self.subscriptions.clear()
+            self.sequence_numbers.clear()
+
+    def wake(self):
+        '''Poll for notifications as soon as possible.'''
+        self.woken.set()
+
+    def run(self):
+        '''Poll for notifications until stopped.'''
+        interval = self.wait_interval
+        while not self.stopped.is_set():
+            try:
+                delivered = self.poll()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to fetch CUPS notifications')
+                delivered = 0
+
+            if delivered:
+                interval = self.wait_interval
+            else:
+                interval = min(interval * 2, self.idle_interval)
+
+            self.woken.wait(interval)
+            if self.woken.is_set():
+                self.woken.clear()
+                interval = self.wait_interval
+
+    def poll(self) -> int:
+        '''Fetch one batch of notifications, dispatch them and return their amount.'''
+        with self.lock:
+            if not self.subscriptions:
+                return 0
+
+            if time.monotonic() >= self.renew_at:
+                for subscription_id in self.subscriptions:
+                    self.connection.renewSubscription(subscription_id,
+                                                      lease_duration=self.lease_duration)
+                self.renew_at = time.monotonic() + self.lease_duration / 2
+
+            subscription_ids = list(self.subscriptions)
+            fetched_at = time.monotonic()
+            response = self.connection.getNotifications(
+                subscription_ids,
+                sequence_numbers=[self.sequence_numbers[sub] for sub in subscription_ids],
+            )
+
+        server_time = response.get('printer-up-time')
+        events = response.get('events', [])
+        for event in events:
+            subscription_id = event['notify-subscription-id']
+            sequence = event['notify-sequence-number']
+            self.sequence_numbers[subscription_id] = max(
+                self.sequence_numbers.get(subscription_id, 1),
+                sequence + 1,
+            )
+
+            job_event = JobEvent(
+                name=event.get('notify-subscribed-event'),
+                job_index=event.get('notify-job-id'),
+                job_name=event.get('job-name'),
+                job_state=event.get('job-state'),
+                text=event.get('notify-text', ''),
+                sequence=sequence,
+            )
+            events_total.labels(job_event.name).inc()
+            callback = self.subscriptions.get(subscription_id)
+            if callback is not None:
+                callback(job_event)
+
+            # Time spent inside CUPS before the fetch plus the time spent in the bot after it
+            queued_for = 0.0
+            if server_time is not None and event.get('printer-up-time') is not None:
+                queued_for = max(0, server_time - event['printer-up-time'])
+            self.latency.observe(queued_for + time.monotonic() - fetched_at)
+
+        if events:
+            logger.debug('Delivered {} CUPS notifications, latency {}',
+                         len(events), self.latency.summary())
+
+        return len(events)
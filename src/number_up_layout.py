@@ -1,6 +1,6 @@
 from collections import namedtuple
 
-from .cups_server import cups, printer
+from .cups_server import printers
 
 Layout = namedtuple('Layout', ['x_pages', 'y_pages', 'is_portrait'])
 
@@ -12,11 +12,4 @@ layouts = {
     9: Layout(3, 3, is_portrait=True),
 }
 
-number_up_options = sorted(
-    set(layouts.keys()).intersection(
-        cups.getPrinterAttributes(
-            printer,
-            requested_attributes=['number-up-supported']
-        ).get('number-up-supported', (1,))
-    )
-)
+number_up_options = sorted(set(layouts.keys()).intersection(printers.number_up_supported))
@@ -0,0 +1,55 @@
+import os
+import shutil
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Tuple
+
+from .work import WorkHandle
+
+ENABLED = os.getenv('OPTIMIZE_PRINT_FILES', '0') == '1'
+
+
+def optimize_pdf(pdf: BinaryIO, resolution: int, handle: WorkHandle = None) -> Tuple[int, int]:
+    '''Rewrite the PDF to make it cheaper to rasterize for the printer:
+       drop unused objects, merge duplicate images, downsample the images
+       above the printer's resolution and compress the streams.
+       The file is only replaced if that makes it smaller.
+       Return the size before and after optimization.'''
+    pdf.flush()
+    size_before = os.path.getsize(pdf.name)
+
+    with NamedTemporaryFile(suffix='.pdf') as output:
+        image_options = []
+        for kind in ('Color', 'Gray', 'Mono'):
+            image_options += [
+                f'-dDownsample{kind}Images=true',
+                f'-d{kind}ImageResolution={resolution}',
+                f'-d{kind}ImageDownsampleThreshold=1.0',
+            ]
+
+        (handle or WorkHandle()).run(['gs',
+                                      '-q',
+                                      '-dSAFER',
+                                      '-dBATCH',
+                                      '-dNOPAUSE',
+                                      '-sDEVICE=pdfwrite',
+                                      '-dCompatibilityLevel=1.5',
+                                      '-dDetectDuplicateImages=true',
+                                      '-dCompressPages=true',
+                                      '-dCompressFonts=true',
+                                      '-dSubsetFonts=true',
+                                      *image_options,
+                                      f'-sOutputFile={output.name}',
+                                      pdf.name],
+                                     timeout=120)
+        size_after = os.path.getsize(output.name)
+
+        if size_after >= size_before:
+            return size_before, size_before
+
+        pdf.seek(0)
+        output.seek(0)
+        shutil.copyfileobj(output, pdf)
+        pdf.truncate()
+        pdf.seek(0)
+
+    return size_before, size_after
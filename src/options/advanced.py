@@ -1,6 +1,7 @@
 from enum import Enum, auto
+from functools import lru_cache
 
-from telegram import Update, InlineKeyboardMarkup, ParseMode
+from telegram import Update, ParseMode, ReplyMarkup
 from telegram.ext import (
     CallbackContext,
     CallbackQueryHandler,
@@ -9,7 +10,8 @@ from telegram.ext import (
 
 from ..number_up_layout import number_up_options
 from ..print_job import PrintJob
-from ..utils import s, get_inline_keyboard
+from ..quality import get_preset, next_preset, presets
+from ..utils import s, KeyboardTemplate
 
 
 class State(Enum):
@@ -20,49 +22,74 @@ class State(Enum):
 
 def status_text(job: PrintJob) -> str:
     '''Return the readable description of the current settings.'''
+    return get_status_text(job.pages.total != 1, job.duplex, job.quality, job.pages.per_page)
+
+
+@lru_cache(maxsize=None)
+def get_status_text(multiple_pages: bool, duplex: bool, quality: str, per_page: int) -> str:
+    '''Return the description of the settings, which only take a few values.'''
     text = '<b>Current settings</b>:\n'
-    if job.pages.total != 1:
-        if job.duplex:
+    if multiple_pages:
+        if duplex:
             text += ' •  Printing on both sides of the page\n'
         else:
             text += ' •  Printing on only one side of the page\n'
-    # if job.toner_save:
-    #     text += ' •  Toner-save is enabled\n'
-    # else:
-    #     text += ' •  Toner-save is disabled\n'
-    if job.pages.total != 1:
-        text += f' •  {job.pages.per_page} document page{s(job.pages.per_page)} per 1 physical page'
+    if len(presets) > 1:
+        text += f' •  Quality: {get_preset(quality).title}\n'
+    if multiple_pages:
+        text += f' •  {per_page} document page{s(per_page)} per 1 physical page'
 
     return text
 
 
-def get_keyboard(job: PrintJob) -> InlineKeyboardMarkup:
+def get_keyboard(job: PrintJob) -> ReplyMarkup:
     '''Return the keyboard with the conversation's actions.'''
-    prefix = f'{job.id}:advanced:'
+    multiple_pages = job.pages.total != 1
+    return get_keyboard_template(
+        multiple_pages,
+        multiple_pages and job.duplex,
+        multiple_pages and job.pages.per_page < max(number_up_options),
+        job.quality,
+    ).bind(job.id)
+
+
+@lru_cache(maxsize=None)
+def get_keyboard_template(multiple_pages: bool,
+                          duplex: bool,
+                          more_per_page: bool,
+                          quality: str) -> KeyboardTemplate:
+    '''Return the keyboard for the settings, to be bound to a job.'''
     layout = [
         None,
         None,
-        # None,
-        [('🔙 Back', prefix + 'back')],
+        None,
+        [('🔙 Back', 'advanced:back')],
     ]
 
-    if job.pages.total != 1:
-        if job.duplex:
-            layout[0] = [('📄 Print on one side only', prefix + 'duplex')]
+    if multiple_pages:
+        if duplex:
+            layout[0] = [('📄 Print on one side only', 'advanced:duplex')]
         else:
-            layout[0] = [('📄 Print on both sides', prefix + 'duplex')]
+            layout[0] = [('📄 Print on both sides', 'advanced:duplex')]
 
-        if job.pages.per_page < max(number_up_options):
-            layout[1] = [('📖 Print more pages on one page', prefix + 'grid')]
+        if more_per_page:
+            layout[1] = [('📖 Print more pages on one page', 'advanced:grid')]
         else:
-            layout[1] = [('📖 Print less pages on one page', prefix + 'grid')]
+            layout[1] = [('📖 Print less pages on one page', 'advanced:grid')]
+
+    if len(presets) > 1:
+        layout[2] = [(f'🖨 Switch to {next_preset(quality).title.lower()}', 'advanced:quality')]
+
+    return KeyboardTemplate(layout)
 
-    # if job.toner_save:
-    #     layout[2] = [('⚫️ Disable toner-save mode', prefix + 'toner_save')]
-    # else:
-    #     layout[2] = [('⚪️ Enable toner-save mode', prefix + 'toner_save')]
 
-    return get_inline_keyboard(layout)
+@lru_cache(maxsize=None)
+def get_grid_keyboard_template(per_page: int) -> KeyboardTemplate:
+    '''Return the keyboard with the other amounts of pages per physical page.'''
+    return KeyboardTemplate([
+        [(str(amt), f'advanced:grid:{amt}') for amt in number_up_options if amt != per_page],
+        [('🔙 Back', 'advanced:grid:back')]
+    ])
 
 
 def update_advanced(update: Update, context: CallbackContext) -> State:
@@ -71,7 +98,7 @@ def update_advanced(update: Update, context: CallbackContext) -> State:
     job = context.bot_data['jobs'][id]
     context.user_data['current_job_id'] = job.id
 
-    job.status_message.edit_text(
+    job.edit_status(
         status_text(job),
         parse_mode=ParseMode.HTML,
         reply_markup=get_keyboard(job),
@@ -88,21 +115,21 @@ def toggle_duplex(update: Update, context: CallbackContext):
     update.callback_query.answer()
     job.duplex = not job.duplex
 
-    job.status_message.edit_text(
+    job.edit_status(
         status_text(job),
         parse_mode=ParseMode.HTML,
         reply_markup=get_keyboard(job),
     )
 
 
-def toggle_toner_save(update: Update, context: CallbackContext):
-    '''Toggle the toner save setting.'''
+def cycle_quality(update: Update, context: CallbackContext):
+    '''Switch to the next print quality preset.'''
     job_id = context.user_data['current_job_id']
     job = context.bot_data['jobs'][job_id]
     update.callback_query.answer()
-    job.toner_save = not job.toner_save
+    job.quality = next_preset(job.quality).key
 
-    job.status_message.edit_text(
+    job.edit_status(
         status_text(job),
         parse_mode=ParseMode.HTML,
         reply_markup=get_keyboard(job),
@@ -115,17 +142,11 @@ def initiate_grid_selection(update: Update, context: CallbackContext) -> State:
     job = context.bot_data['jobs'][job_id]
     update.callback_query.answer()
 
-    prefix = f'{job.id}:advanced:grid'
-    job.status_message.edit_text(
+    job.edit_status(
         f'For compactness, you can lay out up to {max(number_up_options)} pages of a document '
         'on a physical page.\n\n'
         'Select the desired amount of pages:',
-        reply_markup=get_inline_keyboard([
-            [(str(amt), f'{prefix}:{amt}')
-             for amt in number_up_options
-             if amt != job.pages.per_page],
-            [('🔙 Back', f'{prefix}:back')]
-        ]),
+        reply_markup=get_grid_keyboard_template(job.pages.per_page).bind(job.id),
     )
 
     return State.SELECT_GRID
@@ -140,7 +161,7 @@ def set_grid(update: Update, context: CallbackContext) -> State:
         job.pages.per_page = int(grid_value)
 
     update.callback_query.answer()
-    job.status_message.edit_text(
+    job.edit_status(
         status_text(job),
         parse_mode=ParseMode.HTML,
         reply_markup=get_keyboard(job),
@@ -155,7 +176,7 @@ def end_conversation(update: Update, context: CallbackContext) -> int:
     job = context.bot_data['jobs'][job_id]
     update.callback_query.answer()
 
-    job.status_message.edit_text(
+    job.edit_status(
         job.get_message_text(),
         parse_mode=ParseMode.HTML,
         reply_markup=job.get_keyboard(),
@@ -171,7 +192,7 @@ advanced_handler = ConversationHandler(
     states={
         State.SELECT_SETTING: [
             CallbackQueryHandler(toggle_duplex, pattern='[0-9a-f]+:advanced:duplex'),
-            CallbackQueryHandler(toggle_toner_save, pattern='[0-9a-f]+:advanced:toner_save'),
+            CallbackQueryHandler(cycle_quality, pattern='[0-9a-f]+:advanced:quality'),
             CallbackQueryHandler(initiate_grid_selection, pattern='[0-9a-f]+:advanced:grid'),
             CallbackQueryHandler(end_conversation, pattern='[0-9a-f]+:advanced:back'),
         ],
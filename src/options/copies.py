@@ -1,7 +1,7 @@
 import re
 from enum import Enum, auto
 
-from telegram import Update, InlineKeyboardMarkup, ParseMode
+from telegram import Update, ParseMode, ReplyMarkup
 from telegram.ext import (
     CallbackContext,
     CallbackQueryHandler,
@@ -10,9 +10,9 @@ from telegram.ext import (
 )
 from telegram.ext.filters import Filters
 
-from ..cups_server import cups, printer
+from ..cups_server import printers
 from ..print_job import PrintJob
-from ..utils import s, get_inline_keyboard
+from ..utils import s, KeyboardTemplate
 
 
 class State(Enum):
@@ -20,26 +20,21 @@ class State(Enum):
     UPDATE = auto()
 
 
-max_copies = cups.getPrinterAttributes(
-    printer,
-    requested_attributes=['copies-supported']
-).get('copies-supported', (1, 9999))[1]
+max_copies = printers.max_copies
 number_ptn = re.compile('[0-9]+')
 copies_fmt = (
     'Currently printing {job.copies} cop{s}.\n\n'
     'How many copies should be printed (e.g. 10)?'
 )
+keyboard = KeyboardTemplate([
+    [('➖', 'copies:dec'), ('➕', 'copies:inc')],
+    [('🔙 Back', 'copies:back')],
+])
 
 
-def get_keyboard(job: PrintJob) -> InlineKeyboardMarkup:
+def get_keyboard(job: PrintJob) -> ReplyMarkup:
     '''Return the keyboard with the conversation's actions.'''
-    prefix = f'{job.id}:copies:'
-    layout = [
-        [('➖', prefix + 'dec'), ('➕', prefix + 'inc')],
-        [('🔙 Back', prefix + 'back')],
-    ]
-
-    return get_inline_keyboard(layout)
+    return keyboard.bind(job.id)
 
 
 def update_copies(update: Update, context: CallbackContext) -> State:
@@ -48,7 +43,7 @@ def update_copies(update: Update, context: CallbackContext) -> State:
     job = context.bot_data['jobs'][id]
     context.user_data['current_job_id'] = job.id
 
-    job.status_message.edit_text(
+    job.edit_status(
         copies_fmt.format(job=job, s=s(job.copies, 'ies', 'y')),
         reply_markup=get_keyboard(job),
     )
@@ -65,7 +60,7 @@ def process_input(update: Update, context: CallbackContext):
     job.copies = min(max(1, int(context.matches[0].group())), max_copies)
 
     if job.copies != old_copies:
-        job.status_message.edit_text(
+        job.edit_status(
             copies_fmt.format(job=job, s=s(job.copies, 'ies', 'y')),
             reply_markup=get_keyboard(job),
         )
@@ -79,7 +74,7 @@ def increment(update: Update, context: CallbackContext):
     job = context.bot_data['jobs'][job_id]
     job.copies += 1
 
-    job.status_message.edit_text(
+    job.edit_status(
         copies_fmt.format(job=job, s=s(job.copies, 'ies', 'y')),
         reply_markup=get_keyboard(job),
     )
@@ -93,7 +88,7 @@ def decrement(update: Update, context: CallbackContext):
     if job.copies > 1:
         job.copies -= 1
 
-        job.status_message.edit_text(
+        job.edit_status(
             copies_fmt.format(job=job, s=s(job.copies, 'ies', 'y')),
             reply_markup=get_keyboard(job),
         )
@@ -108,7 +103,7 @@ def end_conversation(update: Update, context: CallbackContext) -> int:
     job = context.bot_data['jobs'][job_id]
     update.callback_query.answer()
 
-    job.status_message.edit_text(
+    job.edit_status(
         job.get_message_text(),
         parse_mode=ParseMode.HTML,
         reply_markup=job.get_keyboard(),
@@ -1,7 +1,7 @@
 import re
 from enum import Enum, auto
 
-from telegram import Update, InlineKeyboardMarkup, ParseMode
+from telegram import Update, ParseMode, ReplyMarkup
 from telegram.ext import (
     CallbackContext,
     CallbackQueryHandler,
@@ -10,7 +10,7 @@ from telegram.ext import (
 )
 from telegram.ext.filters import Filters
 
-from ..utils import s, get_inline_keyboard
+from ..utils import s, KeyboardTemplate
 
 
 class State(Enum):
@@ -24,24 +24,23 @@ page_status_fmt = (
     'The document has {job.pages.total} page{s}.\n\n'
     'What pages should be {verbed} (e.g. 1 or 4-5)?'
 )
-
-
-def get_keyboard(state: State, id: str) -> InlineKeyboardMarkup:
+keyboards = {
+    State.ADD: KeyboardTemplate([
+        [('➖ I want to remove pages', 'pages:remove')],
+        [('📖 Add all pages', 'pages:add_all')],
+        [('🔙 Back', 'pages:back')],
+    ]),
+    State.REMOVE: KeyboardTemplate([
+        [('➕ I want to add pages', 'pages:add')],
+        [('📖 Remove all pages', 'pages:remove_all')],
+        [('🔙 Back', 'pages:back')],
+    ]),
+}
+
+
+def get_keyboard(state: State, id: str) -> ReplyMarkup:
     '''Return the keyboard that's appropriate for the current conversation state.'''
-    prefix = f'{id}:pages:'
-    layout = [
-        None,
-        None,
-        [('🔙 Back', prefix + 'back')],
-    ]
-    if state == State.ADD:
-        layout[0] = [('➖ I want to remove pages', prefix + 'remove')]
-        layout[1] = [('📖 Add all pages', prefix + 'add_all')]
-    else:
-        layout[0] = [('➕ I want to add pages', prefix + 'add')]
-        layout[1] = [('📖 Remove all pages', prefix + 'remove_all')]
-
-    return get_inline_keyboard(layout)
+    return keyboards[state].bind(id)
 
 
 def update_pages(update: Update, context: CallbackContext) -> State:
@@ -57,7 +56,7 @@ def update_pages(update: Update, context: CallbackContext) -> State:
         verb = 'added'
         state = State.ADD
 
-    job.status_message.edit_text(
+    job.edit_status(
         page_status_fmt.format(job=job, s=s(job.pages.total), verbed=verb),
         reply_markup=get_keyboard(state, id),
     )
@@ -78,7 +77,7 @@ def process_addition(update: Update, context: CallbackContext):
             job.pages.add(slice(int(range[0]) - 1, int(range[1])))
 
     if str(job.pages) != old_selection:
-        job.status_message.edit_text(
+        job.edit_status(
             page_status_fmt.format(job=job, s=s(job.pages.total), verbed='added'),
             reply_markup=get_keyboard(State.ADD, job.id),
         )
@@ -98,7 +97,7 @@ def process_removal(update: Update, context: CallbackContext):
             job.pages.remove(slice(int(range[0]) - 1, int(range[1])))
 
     if str(job.pages) != old_selection:
-        job.status_message.edit_text(
+        job.edit_status(
             page_status_fmt.format(job=job, s=s(job.pages.total), verbed='removed'),
             reply_markup=get_keyboard(State.REMOVE, job.id),
         )
@@ -114,7 +113,7 @@ def add_all(update: Update, context: CallbackContext) -> State:
     job.pages.add(slice(0, job.pages.total))
 
     if str(job.pages) != old_selection:
-        job.status_message.edit_text(
+        job.edit_status(
             page_status_fmt.format(job=job, s=s(job.pages.total), verbed='removed'),
             reply_markup=get_keyboard(State.REMOVE, job.id),
         )
@@ -131,7 +130,7 @@ def remove_all(update: Update, context: CallbackContext) -> State:
     job.pages.remove(slice(0, job.pages.total))
 
     if str(job.pages) != old_selection:
-        job.status_message.edit_text(
+        job.edit_status(
             page_status_fmt.format(job=job, s=s(job.pages.total), verbed='added'),
             reply_markup=get_keyboard(State.ADD, job.id),
         )
@@ -145,7 +144,7 @@ def switch_to_remove(update: Update, context: CallbackContext) -> State:
     job_id = context.user_data['current_job_id']
     job = context.bot_data['jobs'][job_id]
 
-    job.status_message.edit_text(
+    job.edit_status(
         page_status_fmt.format(job=job, s=s(job.pages.total), verbed='removed'),
         reply_markup=get_keyboard(State.REMOVE, job.id),
     )
@@ -159,7 +158,7 @@ def switch_to_add(update: Update, context: CallbackContext) -> State:
     job_id = context.user_data['current_job_id']
     job = context.bot_data['jobs'][job_id]
 
-    job.status_message.edit_text(
+    job.edit_status(
         page_status_fmt.format(job=job, s=s(job.pages.total), verbed='added'),
         reply_markup=get_keyboard(State.ADD, job.id),
     )
@@ -174,7 +173,7 @@ def end_conversation(update: Update, context: CallbackContext) -> int:
     job = context.bot_data['jobs'][job_id]
     update.callback_query.answer()
 
-    job.status_message.edit_text(
+    job.edit_status(
         job.get_message_text(),
         parse_mode=ParseMode.HTML,
         reply_markup=job.get_keyboard(),
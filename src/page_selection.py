@@ -5,6 +5,7 @@ from typing import List, Generator
 
 class PageSelection:
     '''A selection of pages (not necessarily continuous).'''
+    __slots__ = ('total', 'selection', 'per_page')
 
     def __init__(self, page_amount: int):
         self.total: int = page_amount
@@ -1,74 +1,325 @@
+import hashlib
+import os
 import re
+import time
 from datetime import datetime
-from typing import BinaryIO
+from functools import lru_cache
+from tempfile import NamedTemporaryFile
+from threading import Lock, Thread
+from typing import Dict, List, Optional
 from uuid import uuid4
 
 from PyPDF4 import PdfFileReader
-from telegram import InlineKeyboardMarkup, ParseMode
+from cups import IPPError
+from telegram import Bot, Message, ParseMode, ReplyMarkup
 
-from .cups_server import cups, printer
+from .cups_server import cups, notifier, printers
+from .logs import get_logger
+from .metrics import counter, stage_seconds
 from .number_up_layout import layouts
+from .optimizer import ENABLED as OPTIMIZE_PRINT_FILES, optimize_pdf
 from .page_selection import PageSelection
-from .utils import s, get_inline_keyboard, is_portrait, apply_page_selection
+from .quality import DEFAULT_PRESET, get_preset, presets
+from .scheduler import scheduler
+from .sheet_planner import SheetPlanner
+from .spool import SpoolFile
+from .utils import (
+    s,
+    KeyboardTemplate,
+    bind_keyboard,
+    count_orientations,
+    write_pages,
+)
+from .work import Cancelled, WorkHandle
 
 page_range_ptn = re.compile(r'([0-9]+)(?:\s*[-–]\s*([0-9]+))?')
+# Jobs printing more physical pages than this are submitted in chunks
+STREAMING_THRESHOLD = int(os.getenv('STREAMING_THRESHOLD_PAGES', '100'))
+CHUNK_SHEETS = int(os.getenv('STREAMING_CHUNK_SHEETS', '25'))
 
+jobs_total = counter('printer_jobs', 'Print jobs that reached a final state', ['state'])
+
+logger = get_logger(__name__)
+
+
+class JobDetails:
+    '''The parts of a print job that are rarely needed and usually empty.'''
+    __slots__ = ('potential_page_ranges', 'content_hash', 'preview_file_id',
+                 'size_before_optimization', 'size_after_optimization', 'submitted_at')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class Detail:
+    '''An attribute of a print job that is kept in its details,
+       which are only created once one of them is set.'''
+
+    def __init__(self):
+        self.name = ''
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, job, owner: type = None):
+        if job is None:
+            return self
+        return getattr(job.details, self.name) if job.details is not None else None
+
+    def __set__(self, job, value):
+        if job.details is None:
+            if value is None:
+                return
+            job.details = JobDetails()
+        setattr(job.details, self.name, value)
+
+
+class PrintJob:  # pylint: disable=too-many-public-methods
+    '''An object representing a document to print with the printing options.
+
+       There may be thousands of jobs at once, so they are kept compact:
+       the file is only opened when it's needed, the status message is referred to by IDs
+       and the rarely used attributes are stored separately, only when they are set.'''
+    __slots__ = ('id', 'user_id', 'state', 'copies', 'pages', 'quality', 'duplex', 'portrait',
+                 'mixed_orientation', 'converted', 'spool_path', 'original_name', 'printer',
+                 'job_indices', 'streaming', 'chat_id', 'message_id', 'created_at',
+                 'queue_position', 'submission_lock', 'work', 'details')
+    # The bot that edits the status messages of all the jobs
+    bot: Optional[Bot] = None
+
+    potential_page_ranges = Detail()
+    content_hash = Detail()
+    preview_file_id = Detail()
+    size_before_optimization = Detail()
+    size_after_optimization = Detail()
+    submitted_at = Detail()
 
-class PrintJob:
-    '''An object representing a document to print with the printing options.'''
     STATE_PREPARING = 1
     STATE_WAITING = 2
     STATE_SENT = 3
     STATE_EXPIRED = 4
     STATE_CANCELLED = 5
+    STATE_QUEUED = 6
+    FINAL_STATES = {STATE_SENT: 'sent', STATE_EXPIRED: 'expired', STATE_CANCELLED: 'cancelled'}
 
-    def __init__(self, container: BinaryIO, converted: bool, caption: str, toner_save: bool = True):
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 container: SpoolFile,
+                 converted: bool,
+                 caption: str,
+                 user_id: int,
+                 *,
+                 quality: str = DEFAULT_PRESET,
+                 work: WorkHandle = None):
+        '''Analyze the document in the container, which the job takes over and closes.'''
         reader = PdfFileReader(container)
 
-        self.container = container
+        self.spool_path = container.name
+        self.original_name = container.original_name
+        self.user_id = user_id
         self.converted = converted
         self.copies = 1
         self.pages = PageSelection(reader.numPages)
-        self.toner_save = toner_save
+        self.quality = get_preset(quality).key
         self.duplex = self.pages.total != 1
-        self.portrait = is_portrait(reader)
+        portrait_pages, landscape_pages = count_orientations(reader)
+        self.portrait = portrait_pages > landscape_pages
+        self.mixed_orientation = bool(portrait_pages and landscape_pages)
         self.id = uuid4().hex
-        self.job_index = None
-        self.status_message = None
+        self.printer = None
+        self.job_indices: List[int] = []
+        # Whether the chunks of the document are still being sent
+        self.streaming = False
+        self.submission_lock = Lock()
+        # The conversion and preparation of the file, stopped when the job dies
+        self.work = work or WorkHandle()
+        self.work.job_id = self.id
+        self.queue_position = None
+        self.chat_id = None
+        self.message_id = None
+        self.details = None
         self.state = self.STATE_PREPARING
-        self.created_at = datetime.now()
-        self.potential_page_ranges = page_range_ptn.findall(caption or '')
+        self.created_at = time.time()
+        self.potential_page_ranges = page_range_ptn.findall(caption or '') or None
+
+        container.close()
 
-        self.container.seek(0)
+    def to_record(self) -> dict:
+        '''Return the durable part of the job as plain data.'''
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'state': self.state,
+            'spool_path': self.spool_path,
+            'original_name': self.original_name,
+            'converted': self.converted,
+            'copies': self.copies,
+            'total': self.pages.total,
+            'selection': [[interval.start, interval.stop] for interval in self.pages.selection],
+            'per_page': self.pages.per_page,
+            'quality': self.quality,
+            'duplex': self.duplex,
+            'portrait': self.portrait,
+            'mixed_orientation': self.mixed_orientation,
+            'printer': self.printer,
+            'job_indices': list(self.job_indices),
+            'streaming': self.streaming,
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat(),
+            'potential_page_ranges': self.potential_page_ranges and [
+                list(range) for range in self.potential_page_ranges
+            ],
+            'content_hash': self.content_hash,
+            'preview_file_id': self.preview_file_id,
+            'size_before_optimization': self.size_before_optimization,
+            'size_after_optimization': self.size_after_optimization,
+            'submitted_at': self.submitted_at,
+        }
+
+    @classmethod
+    def from_record(cls, record: dict):
+        '''Restore a job from its record, or return None if it can no longer be printed.'''
+        if (record['state'] in (cls.STATE_EXPIRED, cls.STATE_CANCELLED)
+                or record['message_id'] is None
+                or not os.path.exists(record['spool_path'])):
+            return None
+
+        job = cls.__new__(cls)
+        job.id = record['id']
+        job.user_id = record['user_id']
+        job.spool_path = record['spool_path']
+        job.original_name = record['original_name']
+        job.converted = record['converted']
+        job.portrait = record['portrait']
+        job.mixed_orientation = record.get('mixed_orientation', False)
+        job.pages = PageSelection(record['total'])
+        job.submission_lock = Lock()
+        job.work = WorkHandle()
+        job.work.job_id = job.id
+        job.queue_position = None
+        job.chat_id = record['chat_id']
+        job.message_id = record['message_id']
+        job.created_at = datetime.fromisoformat(record['created_at']).timestamp()
+        job.details = None
+        job.apply_record(record)
+        return job
+
+    def apply_record(self, record: dict):
+        '''Take over the settings and the state from a record of this job.'''
+        self.state = record['state']
+        self.copies = record['copies']
+        self.pages.selection = [slice(start, stop) for start, stop in record['selection']]
+        self.pages.per_page = record['per_page']
+        self.quality = record.get('quality', DEFAULT_PRESET)
+        self.duplex = record['duplex']
+        self.printer = record['printer']
+        self.job_indices = record['job_indices']
+        self.streaming = record.get('streaming', False)
+        self.potential_page_ranges = record['potential_page_ranges'] or None
+        self.content_hash = record.get('content_hash')
+        self.preview_file_id = record.get('preview_file_id')
+        self.size_before_optimization = record.get('size_before_optimization')
+        self.size_after_optimization = record.get('size_after_optimization')
+        self.submitted_at = record.get('submitted_at')
+
+    @property
+    def job_index(self) -> Optional[int]:
+        '''The CUPS job of the last submitted part of the document.'''
+        return self.job_indices[-1] if self.job_indices else None
+
+    def open(self) -> SpoolFile:
+        '''Open the file to print, which the caller should close.'''
+        container = SpoolFile(self.spool_path)
+        container.original_name = self.original_name
+        return container
+
+    def set_status_message(self, message: Message):
+        '''Remember the message that shows the status of the job.'''
+        self.chat_id = message.chat_id
+        self.message_id = message.message_id
+
+    def edit_status(self, text: str, **kwargs):
+        '''Replace the text of the status message, taking the arguments of `edit_message_text`.'''
+        return self.bot.edit_message_text(text,
+                                          chat_id=self.chat_id,
+                                          message_id=self.message_id,
+                                          **kwargs)
+
+    def get_content_hash(self) -> str:
+        '''Return the hash of the file to print.'''
+        if self.content_hash is None:
+            digest = hashlib.sha256()
+            with self.open() as container:
+                for chunk in iter(lambda: container.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            self.content_hash = digest.hexdigest()
+        return self.content_hash
+
+    def resume(self):
+        '''Continue where the job left off before a restart.'''
+        if self.state == self.STATE_QUEUED:
+            # Streaming starts over, after the chunks that were sent, once it's released
+            self.streaming = False
+            scheduler.submit(self)
+        elif self.streaming:
+            Thread(target=self.stream,
+                   args=(self.get_print_options(), self.get_sheet_planner()),
+                   daemon=True).start()
 
     def get_message_text(self) -> str:
         '''Return the message text that is appropriate for the current state and settings.'''
         if not self.pages:
             return 'No pages selected, I can\'t print nothing 🙃'
 
-        if self.state == self.STATE_PREPARING:
+        multiple_pages = self.pages.total != 1
+        template = self.get_text_template(self.state,
+                                          multiple_pages,
+                                          multiple_pages and self.duplex,
+                                          self.pages.per_page,
+                                          self.quality,
+                                          self.converted)
+        # The selection is only turned into text if the template shows it
+        return template.format(copies=self.copies,
+                               copies_ending=s(self.copies, 'ies', 'y'),
+                               pages=self.pages,
+                               queue_position=self.queue_position)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_text_template(state: int,  # pylint: disable=too-many-arguments
+                          multiple_pages: bool,
+                          duplex: bool,
+                          per_page: int,
+                          quality: str,
+                          converted: bool) -> str:
+        '''Return the message text for the state and settings,
+           with fields for the copies, the pages and the place in line.'''
+        if state == PrintJob.STATE_PREPARING:
             text = '<b>Ready to print!</b>\n'
-        elif self.state == self.STATE_WAITING:
+        elif state == PrintJob.STATE_QUEUED:
+            text = '<b>Waiting in line, #{queue_position}</b>\n'
+        elif state == PrintJob.STATE_WAITING:
             text = '<b>Waiting in queue</b>\n'
-        elif self.state == self.STATE_SENT:
+        elif state == PrintJob.STATE_SENT:
             text = '<b>Sent for printing!</b>\n'
-        elif self.state == self.STATE_EXPIRED:
+        elif state == PrintJob.STATE_EXPIRED:
             text = '<b>Job expired</b>\nForward the file to print again.\n'
-        elif self.state == self.STATE_CANCELLED:
+        elif state == PrintJob.STATE_CANCELLED:
             text = '<b>Job cancelled</b>\nForward the file to print again.\n'
         else:
             text = '<b>Something broke down :(</b>'
 
-        text += f' •  {self.copies} cop{s(self.copies, "ies", "y")}\n'
-        if self.pages.total != 1:
-            text += f' •  Pages: {str(self.pages)}\n'
-            text += f' •  Printing on {"both sides" if self.duplex else "one side"} of the page\n'
-        if self.pages.per_page != 1:
-            text += f' •  {self.pages.per_page} page{s(self.pages.per_page)} per page\n'
-        # if self.toner_save:
-        #     text += ' •  Toner-save is <u>enabled</u>\n'
+        text += ' •  {copies} cop{copies_ending}\n'
+        if multiple_pages:
+            text += ' •  Pages: {pages}\n'
+            text += f' •  Printing on {"both sides" if duplex else "one side"} of the page\n'
+        if per_page != 1:
+            text += f' •  {per_page} page{s(per_page)} per page\n'
+        if quality != DEFAULT_PRESET:
+            text += f' •  Quality: {get_preset(quality).title}\n'
 
-        if self.converted and self.state == self.STATE_PREPARING:
+        if converted and state == PrintJob.STATE_PREPARING:
             text += (
                 '\n<i>Note:</i> this file was converted to PDF for printing. '
                 'Some formatting details may have been lost, '
@@ -77,37 +328,64 @@ class PrintJob:
 
         return text
 
-    def get_keyboard(self) -> InlineKeyboardMarkup:
+    def get_keyboard(self) -> Optional[ReplyMarkup]:
         '''Return an inline keyboard that is appropriate for the current state and settings.'''
-        prefix = f'{self.id}:'
-
         if self.state == self.STATE_PREPARING:
+            has_pages = bool(self.pages)
+            template = self.get_keyboard_template(
+                self.state,
+                has_pages,
+                self.converted,
+                self.pages.total == 1,
+                not self.portrait and self.pages.total > 5 and 1 in self.pages,
+                bool(self.potential_page_ranges),
+            )
+        else:
+            template = self.get_keyboard_template(self.state)
+
+        return bind_keyboard(template, self.id)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_keyboard_template(state: int,  # pylint: disable=too-many-arguments
+                              has_pages: bool = False,
+                              converted: bool = False,
+                              single_page: bool = False,
+                              suggest_no_title: bool = False,
+                              suggest_caption: bool = False) -> Optional[KeyboardTemplate]:
+        '''Return the keyboard for the state and settings, to be bound to a job.'''
+        if state == PrintJob.STATE_PREPARING:
+            preview_row = [('Preview', 'page_preview')]
+            if converted:
+                preview_row.append(('Converted PDF', 'preview'))
+
             layout = [
-                self.pages and [('Print', prefix + 'print')],
-                self.converted and [('Preview', prefix + 'preview')],
+                has_pages and [('Print', 'print')],
+                has_pages and preview_row,
                 None,
                 None,
-                [('Pages', prefix + 'pages'), ('Copies', prefix + 'copies')],
-                [('Advanced settings', prefix + 'advanced')],
+                [('Pages', 'pages'), ('Copies', 'copies')],
+                [('Advanced settings', 'advanced')],
             ]
 
-            if self.pages.total == 1:
-                # Remove the `Advanced settings` button
-                layout.pop(5)
+            if single_page:
+                if len(presets) == 1:
+                    # Remove the `Advanced settings` button
+                    layout.pop(5)
                 # Remove the `Pages` button
                 layout[4].pop(0)
 
-            if not self.portrait and self.pages.total > 5 and 1 in self.pages:
-                layout[2] = [('💡 Exclude the title page', prefix + 'no_title')]
+            if suggest_no_title:
+                layout[2] = [('💡 Exclude the title page', 'no_title')]
 
-            if self.potential_page_ranges:
-                layout[3] = [('💡 Select the pages in the caption', prefix + 'parse_caption')]
-        elif self.state == self.STATE_WAITING:
-            layout = [[('Cancel', prefix + 'cancel')]]
+            if suggest_caption:
+                layout[3] = [('💡 Select the pages in the caption', 'parse_caption')]
+        elif state in (PrintJob.STATE_QUEUED, PrintJob.STATE_WAITING):
+            layout = [[('Cancel', 'cancel')]]
         else:
-            layout = None
+            return None
 
-        return get_inline_keyboard(layout)
+        return KeyboardTemplate(layout)
 
     def parse_caption(self):
         '''Initialize the page selection with the ranges from the caption.'''
@@ -121,51 +399,201 @@ class PrintJob:
 
         self.potential_page_ranges = None
 
-    def start(self):
-        '''Initiate a print job with all the settings.'''
+    def submit(self):
+        '''Put the job in line for printing.'''
+        self.state = self.STATE_QUEUED
+        scheduler.submit(self)
+
+    def set_queue_position(self, position: int):
+        '''Update the place of the job in line, updating its message.'''
+        if self.state == self.STATE_QUEUED and position != self.queue_position:
+            self.queue_position = position
+            self.set_state(self.STATE_QUEUED)
+
+    def get_print_options(self) -> Dict[str, str]:
+        '''Return the CUPS options for all the settings of the job.'''
         layout = layouts[self.pages.per_page]
         print_options = {
             'multiple-document-handling': 'separate-documents-collated-copies',
             'copies': str(self.copies),
-            # 'print-quality': '3' if self.toner_save else '5',
-            # 'PrintoutMode': 'Draft.Gray' if self.toner_save else 'High.Gray',
             'number-up': str(self.pages.per_page),
             'number-up-layout': 'btlr',
             'media': 'a4',
+            **get_preset(self.quality).options,
         }
 
-        if self.pages.per_page == 1:
-            print_options['page-ranges'] = repr(self.pages)
-        else:
-            # The printer setting for page ranges applies after the N-up,
-            #   which is counter-intuitive, so we exclude pages manually
-            apply_page_selection(self.container, self.pages)
-
         if self.duplex:
             length = 'long' if self.portrait == layout.is_portrait else 'short'
             print_options['sides'] = f'two-sided-{length}-edge'
         else:
             print_options['sides'] = 'one-sided'
+        return print_options
+
+    def start(self):
+        '''Initiate a print job with all the settings.'''
+        print_options = self.get_print_options()
+        planner = self.get_sheet_planner()
+        if self.copies == 1 and self.pages.to_print > STREAMING_THRESHOLD:
+            self.streaming = True
+            Thread(target=self.stream, args=(print_options, planner), daemon=True).start()
+            return
+
+        if self.pages.per_page == 1 and planner is None and not OPTIMIZE_PRINT_FILES:
+            print_options['page-ranges'] = repr(self.pages)
+            self.send(self.spool_path, print_options)
+            return
 
-        self.job_index = cups.printFile(printer, self.container.name, self.id, print_options)
+        # The printer setting for page ranges applies after the N-up,
+        #   which is counter-intuitive, so we exclude pages manually.
+        #   This also leaves the optimizer only the resources of the selected pages
+        #   and turns the pages of the other orientation in the same pass.
+        #   The document itself is left as it is in case the job is submitted again.
+        with NamedTemporaryFile(suffix='.pdf') as print_file:
+            try:
+                with stage_seconds.labels('page_selection').time(), self.open() as container:
+                    write_pages(PdfFileReader(self.work.wrap(container)),
+                                self.pages,
+                                print_file,
+                                self.work,
+                                planner)
+                print_file.flush()
+
+                if OPTIMIZE_PRINT_FILES:
+                    with stage_seconds.labels('optimize').time():
+                        self.record_optimization(
+                            *optimize_pdf(print_file, printers.resolution, self.work)
+                        )
+            except Cancelled:
+                return
+
+            self.send(print_file.name, print_options)
+
+    def send(self, filename: str, print_options: Dict[str, str]):
+        '''Submit the prepared print file to CUPS unless the job died in the meantime.'''
+        if self.work.cancelled:
+            return
+        with stage_seconds.labels('submit').time():
+            self.printer, job_index = printers.submit(filename, self.id, print_options)
+        self.job_indices.append(job_index)
+        self.submitted_at = time.time()
+        notifier.wake()
         self.set_state(self.STATE_WAITING)
 
+    def fail(self, reason: str):
+        '''Put the job back so that the user can try again, telling them what went wrong.'''
+        self.state = self.STATE_PREPARING
+        self.queue_position = None
+        self.edit_status(
+            f'<b>{reason}</b>\n\n{self.get_message_text()}',
+            reply_markup=self.get_keyboard(),
+            parse_mode=ParseMode.HTML,
+        )
+
+    def get_sheet_planner(self) -> Optional[SheetPlanner]:
+        '''Return the planner that turns the pages of a document with mixed orientation,
+           or None if the pages can be printed as they are.'''
+        if not (self.duplex and self.mixed_orientation):
+            return None
+        return SheetPlanner(self.portrait, self.duplex, self.pages.per_page)
+
+    def chunks(self) -> List[List[int]]:
+        '''Split the selected pages into chunks that start on a new physical sheet.'''
+        pages_per_sheet = self.pages.per_page * (2 if self.duplex else 1)
+        chunk_size = CHUNK_SHEETS * pages_per_sheet
+        pages = list(self.pages)
+        return [pages[idx:idx + chunk_size] for idx in range(0, len(pages), chunk_size)]
+
+    def stream(self, print_options: Dict[str, str], planner: SheetPlanner = None):
+        '''Submit the job in chunks, preparing the next chunk while the previous one prints.
+           The chunks that were sent before a restart are skipped.'''
+        container = self.open()
+        try:
+            reader = PdfFileReader(self.work.wrap(container))
+            for chunk in self.chunks()[len(self.job_indices):]:
+                with NamedTemporaryFile(suffix='.pdf') as chunk_file:
+                    with stage_seconds.labels('page_selection').time():
+                        write_pages(reader, chunk, chunk_file, self.work, planner)
+                    chunk_file.flush()
+                    if OPTIMIZE_PRINT_FILES:
+                        with stage_seconds.labels('optimize').time():
+                            self.record_optimization(
+                                *optimize_pdf(chunk_file, printers.resolution, self.work)
+                            )
+
+                    with self.submission_lock:
+                        if self.state in (self.STATE_CANCELLED, self.STATE_EXPIRED):
+                            return
+                        if self.printer is None:
+                            self.printer, job_index = printers.submit(
+                                chunk_file.name, self.id, print_options,
+                            )
+                        else:
+                            # Keep all chunks on the same printer so that they come out in order
+                            job_index = cups.printFile(
+                                self.printer, chunk_file.name, self.id, print_options,
+                            )
+                        self.job_indices.append(job_index)
+                        if self.submitted_at is None:
+                            self.submitted_at = time.time()
+
+                notifier.wake()
+                if self.state == self.STATE_QUEUED:
+                    self.set_state(self.STATE_WAITING)
+        except Cancelled:
+            pass
+        except Exception:  # pylint: disable=broad-except
+            with self.submission_lock:
+                if self.state in (self.STATE_CANCELLED, self.STATE_EXPIRED):
+                    return
+                logger.exception('Streaming job {} failed', self.id)
+                # The rest of the document is missing, so withdraw the chunks sent so far
+                for job_index in self.job_indices:
+                    try:
+                        cups.cancelJob(job_index, purge_job=True)
+                    except IPPError:
+                        # Already printed
+                        pass
+                self.job_indices = []
+                self.printer = None
+                self.submitted_at = None
+            self.fail('Could not send the whole document to the printer, please try again.')
+        finally:
+            self.streaming = False
+            container.close()
+
+    def record_optimization(self, size_before: int, size_after: int):
+        '''Add up the sizes of the print file (or its chunks) before and after optimization.'''
+        self.size_before_optimization = (self.size_before_optimization or 0) + size_before
+        self.size_after_optimization = (self.size_after_optimization or 0) + size_after
+
     def expire(self):
         '''Expire the job, freeing up its resources.'''
-        self.container.close()
+        self.work.cancel()
+        if self.state == self.STATE_QUEUED:
+            scheduler.remove(self)
+        SpoolFile.remove(self.spool_path)
         if self.state != self.STATE_SENT:
             self.set_state(self.STATE_EXPIRED)
 
     def cancel(self):
         '''Cancel the job, freeing up its resources.'''
-        cups.cancelJob(self.job_index, purge_job=True)
-        self.container.close()
+        # Stop the preparation first, it may be holding up the scheduler that we need below
+        self.work.cancel()
+        with self.submission_lock:
+            if self.state == self.STATE_QUEUED:
+                scheduler.remove(self)
+            for job_index in self.job_indices:
+                cups.cancelJob(job_index, purge_job=True)
+            self.state = self.STATE_CANCELLED
+        SpoolFile.remove(self.spool_path)
         self.set_state(self.STATE_CANCELLED)
 
     def set_state(self, new_state):
         '''Set a new state for the print job, updating its message.'''
+        if new_state in self.FINAL_STATES:
+            jobs_total.labels(self.FINAL_STATES[new_state]).inc()
         self.state = new_state
-        self.status_message.edit_text(
+        self.edit_status(
             self.get_message_text(),
             reply_markup=self.get_keyboard(),
             parse_mode=ParseMode.HTML,
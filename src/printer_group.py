@@ -0,0 +1,192 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from cups import IPPError
+
+from .cups_client import CupsClient, CupsTimeout
+from .logs import get_logger
+
+PRINTER_STATE_STOPPED = 5
+JOB_STATE_PENDING = 3
+RESOLUTION_UNITS_DPI = 3
+
+logger = get_logger(__name__)
+
+
+class PrinterGroup:
+    '''A group of compatible printers that print jobs are balanced across.
+
+       A job goes to the online printer with the fewest pending pages
+       among those that support its N-up and duplex settings.
+       If the submission fails, the next best printer is tried.'''
+
+    def __init__(self, client: CupsClient, names: List[str], attributes_ttl: float = 60):
+        self.client = client
+        self.names = names
+        self.attributes_ttl = attributes_ttl
+        self.attributes: Dict[str, Tuple[float, dict]] = {}
+
+    def get_attributes(self, name: str) -> dict:
+        '''Return the printer's capabilities and state, cached for a short time.'''
+        fetched_at, attributes = self.attributes.get(name, (0, None))
+        if attributes is None or time.monotonic() - fetched_at > self.attributes_ttl:
+            attributes = self.client.getPrinterAttributes(
+                name,
+                requested_attributes=[
+                    'copies-supported',
+                    'number-up-supported',
+                    'sides-supported',
+                    'printer-state',
+                    'printer-is-accepting-jobs',
+                    'printer-resolution-default',
+                    'print-quality-supported',
+                    'print-color-mode-supported',
+                ],
+            )
+            self.attributes[name] = (time.monotonic(), attributes)
+        return attributes
+
+    @property
+    def number_up_supported(self) -> List[int]:
+        '''Return the N-up values supported by at least one printer.'''
+        return sorted(set().union(*(
+            self.get_attributes(name).get('number-up-supported', (1,))
+            for name in self.names
+        )))
+
+    @property
+    def max_copies(self) -> int:
+        '''Return the maximum amount of copies that every printer supports.'''
+        return min(
+            self.get_attributes(name).get('copies-supported', (1, 9999))[1]
+            for name in self.names
+        )
+
+    @property
+    def resolution(self) -> int:
+        '''Return the highest default resolution among the printers, in DPI.'''
+        resolutions = []
+        for name in self.names:
+            x_resolution, _y_resolution, units = self.get_attributes(name).get(
+                'printer-resolution-default', (600, 600, RESOLUTION_UNITS_DPI)
+            )
+            if units != RESOLUTION_UNITS_DPI:
+                # Dots per centimeter
+                x_resolution = round(x_resolution * 2.54)
+            resolutions.append(x_resolution)
+        return max(resolutions)
+
+    def is_online(self, name: str) -> bool:
+        '''Whether the printer is accepting jobs and not stopped.'''
+        attributes = self.get_attributes(name)
+        return (attributes.get('printer-state') != PRINTER_STATE_STOPPED
+                and attributes.get('printer-is-accepting-jobs', True))
+
+    def is_capable(self, name: str, options: Dict[str, str]) -> bool:
+        '''Whether the printer supports the N-up and duplex settings of the job.'''
+        attributes = self.get_attributes(name)
+        number_up = int(options.get('number-up', '1'))
+        sides = options.get('sides', 'one-sided')
+        return (number_up in attributes.get('number-up-supported', (1,))
+                and sides in attributes.get('sides-supported', ('one-sided',)))
+
+    def unfinished_jobs(self) -> Dict[int, dict]:
+        '''Return the jobs that are not completed yet, with their title, printer and progress.'''
+        return self.client.getJobs(
+            which_jobs='not-completed',
+            requested_attributes=[
+                'job-name',
+                'job-printer-uri',
+                'job-impressions',
+                'job-impressions-completed',
+            ],
+        )
+
+    def pending_pages(self, jobs: Dict[int, dict] = None) -> Dict[str, int]:
+        '''Return the amount of pages still to be printed for each printer in the group.'''
+        pending = dict.fromkeys(self.names, 0)
+        if jobs is None:
+            jobs = self.unfinished_jobs()
+        for job in jobs.values():
+            name = job.get('job-printer-uri', '').rsplit('/', 1)[-1]
+            if name in pending:
+                pending[name] += max(1, job.get('job-impressions', 1)
+                                     - job.get('job-impressions-completed', 0))
+        return pending
+
+    def invalidate(self, name: str):
+        '''Forget the cached state of the printer so that it's fetched again.'''
+        self.attributes.pop(name, None)
+
+    @staticmethod
+    def find_job(jobs: Dict[int, dict], title: str) -> Optional[Tuple[str, int]]:
+        '''Return the printer and the CUPS job index of the unfinished job with the title.'''
+        for job_index, job in jobs.items():
+            if job.get('job-name') == title:
+                return job.get('job-printer-uri', '').rsplit('/', 1)[-1], job_index
+        return None
+
+    def submit(self, filename: str, title: str, options: Dict[str, str]) -> Tuple[str, int]:
+        '''Print the file on the least loaded capable printer, failing over to the others.
+           Return the name of the printer and the CUPS job index.
+
+           A submission that timed out may still reach CUPS, so it isn't failed over.
+           If an earlier submission of the title is already in CUPS, that job is returned
+           instead of printing the file again.'''
+        jobs = self.unfinished_jobs()
+        existing = self.find_job(jobs, title)
+        if existing is not None:
+            logger.warning('Job {} is already in CUPS as {}, not submitting it again',
+                           title, existing[1])
+            return existing
+
+        pending = self.pending_pages(jobs)
+        candidates = sorted(
+            (name for name in self.names if self.is_capable(name, options)),
+            key=lambda name: (not self.is_online(name), pending[name]),
+        )
+        if not candidates:
+            raise IPPError(0, 'No printer in the group supports these settings')
+
+        for name in candidates:
+            try:
+                return name, self.client.printFile(name, filename, title, options)
+            except IPPError as error:
+                logger.warning('Printer {} rejected job {} ({}), failing over', name, title, error)
+                self.invalidate(name)
+                last_error = error
+            except CupsTimeout:
+                self.invalidate(name)
+                raise
+
+        raise last_error
+
+    def fail_over(self):
+        '''Move the jobs that have not started printing yet away from the offline printers.'''
+        for name in self.names:
+            self.invalidate(name)
+        offline = [name for name in self.names if not self.is_online(name)]
+        online = [name for name in self.names if name not in offline]
+        if not offline or not online:
+            return
+
+        jobs = self.client.getJobs(
+            which_jobs='not-completed',
+            requested_attributes=['job-printer-uri', 'job-state', 'number-up', 'sides'],
+        )
+        pending = self.pending_pages()
+        for job_index, job in jobs.items():
+            source = job.get('job-printer-uri', '').rsplit('/', 1)[-1]
+            if source not in offline or job.get('job-state') != JOB_STATE_PENDING:
+                continue
+
+            options = {'number-up': str(job.get('number-up', 1)),
+                       'sides': job.get('sides', 'one-sided')}
+            targets = [name for name in online if self.is_capable(name, options)]
+            if targets:
+                target = min(targets, key=pending.get)
+                pending[target] += 1
+                logger.info('Moving job {} from offline printer {} to {}',
+                            job_index, source, target)
+                self.client.moveJob(job_id=job_index,
+                                    job_printer_uri=f'ipp://localhost/printers/{target}')
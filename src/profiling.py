@@ -0,0 +1,216 @@
+import cProfile
+import os
+import pstats
+import signal
+import time
+from collections import defaultdict
+from functools import wraps
+from threading import Lock, Timer, local
+from typing import Callable, Dict, List, Optional
+
+from telegram.ext import ConversationHandler, Handler, Updater
+
+from .cups_client import CupsClient
+from .logs import get_logger
+
+ENABLED = os.getenv('PROFILE_UPDATES', '0') == '1'
+SLOW_UPDATE_SECONDS = float(os.getenv('SLOW_UPDATE_SECONDS', '1.0'))
+PROFILE_WINDOW_SECONDS = float(os.getenv('PROFILE_WINDOW_SECONDS', '60'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+JOB_QUEUE_METHODS = ('run_once', 'run_repeating', 'run_daily', 'run_monthly', 'run_custom')
+
+logger = get_logger(__name__)
+
+
+class Trace:
+    '''The time spent on a single update or job, broken down by stage.'''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.monotonic()
+        self.started_cpu = time.thread_time()
+        self.stages: List[tuple] = []
+        self.calls: Dict[str, List[float]] = defaultdict(list)
+        self.profile: Optional[cProfile.Profile] = None
+
+    def add_stage(self, name: str, wall: float, cpu: float):
+        '''Record the time spent in a handler or a job callback.'''
+        self.stages.append((name, wall, cpu))
+
+    def add_call(self, name: str, duration: float):
+        '''Record an outgoing call to Telegram or CUPS.'''
+        self.calls[name].append(duration)
+
+    def breakdown(self) -> str:
+        '''Return a readable list of the stages and the outgoing calls.'''
+        lines = [f'{name}: {wall:.3f} s wall, {cpu:.3f} s CPU' for name, wall, cpu in self.stages]
+        lines += [f'{name} ×{len(durations)}: {sum(durations):.3f} s'
+                  for name, durations in self.calls.items()]
+        return '\n  '.join(lines)
+
+
+class Profiler:
+    '''Times the handlers and job callbacks of an updater, logs slow updates
+       and collects cProfile statistics for a time window on demand.'''
+
+    def __init__(self, slow_threshold: float = SLOW_UPDATE_SECONDS):
+        self.slow_threshold = slow_threshold
+        self.current = local()
+        self.window_ends_at = 0.0
+        self.stats: Optional[pstats.Stats] = None
+        self.lock = Lock()
+
+    def begin(self, name: str) -> Optional[Trace]:
+        '''Start tracing on the current thread, unless a trace is already going.'''
+        if getattr(self.current, 'trace', None) is not None:
+            return None
+        trace = self.current.trace = Trace(name)
+        if time.monotonic() < self.window_ends_at:
+            trace.profile = cProfile.Profile()
+            try:
+                trace.profile.enable()
+            except ValueError:
+                # Another profiler is active
+                trace.profile = None
+        return trace
+
+    def end(self, trace: Optional[Trace]):
+        '''Finish the trace that `begin` started, logging it if it was slow.'''
+        if trace is None:
+            return
+        self.current.trace = None
+        if trace.profile is not None:
+            trace.profile.disable()
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(trace.profile)
+                else:
+                    self.stats.add(trace.profile)
+
+        wall = time.monotonic() - trace.started_at
+        if wall >= self.slow_threshold:
+            logger.warning('Slow {} took {:.3f} s wall, {:.3f} s CPU:\n  {}',
+                           trace.name, wall, time.thread_time() - trace.started_cpu,
+                           trace.breakdown())
+
+    def wrap_stage(self, name: str, callback: Callable) -> Callable:
+        '''Time the calls to a handler or job callback.'''
+        @wraps(callback)
+        def timed(*args, **kwargs):
+            trace = self.begin(name)
+            started_at, started_cpu = time.monotonic(), time.thread_time()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                current = getattr(self.current, 'trace', None)
+                if current is not None:
+                    current.add_stage(name,
+                                      time.monotonic() - started_at,
+                                      time.thread_time() - started_cpu)
+                self.end(trace)
+        return timed
+
+    def wrap_call(self, prefix: str, function: Callable, name_of: Callable) -> Callable:
+        '''Time the outgoing calls made while tracing.'''
+        @wraps(function)
+        def timed(*args, **kwargs):
+            started_at = time.monotonic()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                trace = getattr(self.current, 'trace', None)
+                if trace is not None:
+                    trace.add_call(f'{prefix} {name_of(*args)}', time.monotonic() - started_at)
+        return timed
+
+    def instrument_handler(self, handler: Handler):
+        '''Time the callback of the handler, or of all the handlers of a conversation.'''
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested += state_handlers
+            for nested_handler in nested:
+                self.instrument_handler(nested_handler)
+        elif not hasattr(handler.callback, '__wrapped__'):
+            handler.callback = self.wrap_stage(stage_name(handler.callback), handler.callback)
+
+    def instrument(self, updater: Updater, cups: CupsClient):
+        '''Time everything that the updater runs along with the Telegram and CUPS calls.'''
+        dispatcher = updater.dispatcher
+        dispatcher.process_update = self.wrap_process_update(dispatcher.process_update)
+        for handlers in dispatcher.handlers.values():
+            for handler in handlers:
+                self.instrument_handler(handler)
+        dispatcher.error_handlers = {
+            self.wrap_stage(stage_name(callback), callback): run_async
+            for callback, run_async in dispatcher.error_handlers.items()
+        }
+
+        job_queue = updater.job_queue
+        for job in job_queue.jobs():
+            job.callback = self.wrap_stage(stage_name(job.callback), job.callback)
+        for method in JOB_QUEUE_METHODS:
+            setattr(job_queue, method, self.wrap_scheduling(getattr(job_queue, method)))
+
+        request = updater.bot.request
+        request.post = self.wrap_call('telegram', request.post,
+                                      lambda url, *_args: url.rsplit('/', 1)[-1])
+        request.retrieve = self.wrap_call('telegram', request.retrieve,
+                                          lambda *_args: 'download')
+        cups.call = self.wrap_call('cups', cups.call, lambda method, *_args: method)
+
+    def wrap_process_update(self, process_update: Callable) -> Callable:
+        '''Trace every update as a whole.'''
+        @wraps(process_update)
+        def traced(update):
+            update_id = getattr(update, 'update_id', None)
+            trace = self.begin(f'update {update_id}')
+            try:
+                return process_update(update)
+            finally:
+                self.end(trace)
+        return traced
+
+    def wrap_scheduling(self, schedule: Callable) -> Callable:
+        '''Time the callbacks of the jobs scheduled from now on.'''
+        @wraps(schedule)
+        def scheduled(callback, *args, **kwargs):
+            return schedule(self.wrap_stage(stage_name(callback), callback), *args, **kwargs)
+        return scheduled
+
+    def start_window(self, seconds: float = PROFILE_WINDOW_SECONDS):
+        '''Profile the updates and jobs for a while, then dump the statistics to a file.'''
+        logger.info('Profiling for {} seconds', seconds)
+        self.window_ends_at = time.monotonic() + seconds
+        Timer(seconds, self.dump).start()
+
+    def dump(self) -> Optional[str]:
+        '''Save the statistics collected during the profiling window for `pstats`/`snakeviz`.'''
+        with self.lock:
+            stats, self.stats = self.stats, None
+        if stats is None:
+            logger.info('Nothing was profiled')
+            return None
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, time.strftime('profile-%Y%m%d-%H%M%S.prof'))
+        stats.dump_stats(path)
+        logger.info('Saved the profile to {}', path)
+        return path
+
+
+def stage_name(callback: Callable) -> str:
+    '''Return a short name of the callback, like `pages.select_pages`.'''
+    module = getattr(callback, '__module__', None) or ''
+    name = getattr(callback, '__qualname__', None) or repr(callback)
+    return f'{module.rsplit(".", 1)[-1]}.{name}' if module else name
+
+
+profiler = Profiler()
+
+
+def install(updater: Updater, cups: CupsClient):
+    '''Instrument the updater and let SIGUSR1 start a profiling window.'''
+    profiler.instrument(updater, cups)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda _signum, _frame: profiler.start_window())
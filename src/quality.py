@@ -0,0 +1,104 @@
+import os
+from collections import namedtuple
+from typing import Dict
+
+from cups import PPD
+
+from .cups_server import cups, printers
+from .logs import get_logger
+from .printer_group import PrinterGroup
+
+Preset = namedtuple('Preset', ['key', 'title', 'options'])
+
+QUALITY_DRAFT = 3
+QUALITY_NORMAL = 4
+QUALITY_HIGH = 5
+# PPD options that drivers commonly use for the print quality
+PPD_QUALITY_OPTIONS = ('PrintoutMode', 'PrintQuality', 'OutputMode', 'cupsPrintQuality', 'Quality')
+DEFAULT_PRESET = 'normal'
+
+logger = get_logger(__name__)
+
+
+def find_ppd_choices(name: str) -> Dict[str, Dict[str, str]]:
+    '''Return the printer's PPD quality option choices for draft and high quality, if any.'''
+    try:
+        # CUPS saves the PPD to a temporary file, which is ours to remove
+        filename = cups.getPPD(name)
+    except Exception:  # pylint: disable=broad-except
+        # Driverless (IPP Everywhere) printers have no PPD
+        return {}
+
+    try:
+        ppd = PPD(filename)
+    except Exception:  # pylint: disable=broad-except
+        return {}
+    finally:
+        os.unlink(filename)
+
+    choices = {}
+    for keyword in PPD_QUALITY_OPTIONS:
+        option = ppd.findOption(keyword)
+        if option is None:
+            continue
+        for choice in option.choices:
+            lowered = choice['choice'].lower()
+            if 'draft' in lowered or 'fast' in lowered:
+                choices.setdefault('draft', {keyword: choice['choice']})
+            elif 'high' in lowered or 'best' in lowered:
+                choices.setdefault('high', {keyword: choice['choice']})
+        break
+    return choices
+
+
+def supported_by_all(group: PrinterGroup, attribute: str) -> set:
+    '''Return the values of the attribute that every printer of the group supports.'''
+    values = [set(group.get_attributes(name).get(attribute, ())) for name in group.names]
+    return set.intersection(*values) if values else set()
+
+
+def discover_presets(group: PrinterGroup) -> Dict[str, Preset]:
+    '''Find out which print quality presets the printers of the group support.'''
+    qualities = supported_by_all(group, 'print-quality-supported')
+    color_modes = supported_by_all(group, 'print-color-mode-supported')
+    ppd_choices = {}
+    for name in group.names:
+        for preset, options in find_ppd_choices(name).items():
+            ppd_choices.setdefault(preset, {}).update(options)
+
+    presets = {DEFAULT_PRESET: Preset(DEFAULT_PRESET, 'Normal', {})}
+    if QUALITY_NORMAL in qualities:
+        presets[DEFAULT_PRESET].options['print-quality'] = str(QUALITY_NORMAL)
+
+    draft = {}
+    if QUALITY_DRAFT in qualities:
+        draft['print-quality'] = str(QUALITY_DRAFT)
+    if 'monochrome' in color_modes:
+        draft['print-color-mode'] = 'monochrome'
+    draft.update(ppd_choices.get('draft', {}))
+    if draft:
+        presets['draft'] = Preset('draft', 'Fast draft', draft)
+
+    high = {}
+    if QUALITY_HIGH in qualities:
+        high['print-quality'] = str(QUALITY_HIGH)
+    high.update(ppd_choices.get('high', {}))
+    if high:
+        presets['high'] = Preset('high', 'High quality', high)
+
+    logger.info('Print quality presets: {}', ', '.join(presets))
+    return presets
+
+
+def get_preset(key: str) -> Preset:
+    '''Return the preset, falling back to the default one if it's not supported.'''
+    return presets.get(key, presets[DEFAULT_PRESET])
+
+
+def next_preset(key: str) -> Preset:
+    '''Return the preset that comes after the given one, wrapping around.'''
+    keys = list(presets)
+    return presets[keys[(keys.index(get_preset(key).key) + 1) % len(keys)]]
+
+
+presets = discover_presets(printers)
@@ -0,0 +1,141 @@
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from threading import RLock
+from typing import Dict
+
+from .cups_server import printers
+from .logs import get_logger
+from .metrics import gauge
+from .printer_group import PrinterGroup
+
+logger = get_logger(__name__)
+
+
+def job_cost(job) -> int:
+    '''Return the amount of physical pages that the job is going to take.'''
+    return job.pages.to_print * job.copies
+
+
+class FairScheduler:
+    '''Hold print jobs in the bot and release them to CUPS with weighted fair queuing.
+
+       Every user gets a share of the printer proportional to their weight
+       and each user's own jobs go shortest first.
+       Jobs are released only while the printers have less than
+       `threshold` pending pages each, so a long job cannot block the short ones behind it.
+       Released jobs are prepared and sent by the scheduler's own workers.'''
+
+    def __init__(self,
+                 group: PrinterGroup,
+                 threshold: int = 10,
+                 weights: Dict[int, float] = None,
+                 workers: int = 2):
+        self.group = group
+        self.threshold = threshold
+        self.weights = weights or {}
+        self.queues: Dict[int, list] = {}
+        self.finish_tags: Dict[int, float] = {}
+        self.virtual_time = 0.0
+        self.sequence = count()
+        # The pages of the released jobs that haven't reached CUPS yet
+        self.starting_pages = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduler')
+        self.lock = RLock()
+
+    def tag(self, user_id: int, start: float, job) -> float:
+        '''Return the virtual finish time of the job if it started at `start`.'''
+        return start + job_cost(job) / self.weights.get(user_id, 1)
+
+    def order(self) -> list:
+        '''Return the tagged jobs in the order they are going to be released.'''
+        queues = {user_id: sorted(queue) for user_id, queue in self.queues.items() if queue}
+        heap = [
+            (self.tag(user_id,
+                      max(self.virtual_time, self.finish_tags.get(user_id, 0)),
+                      queue[0][2]),
+             user_id)
+            for user_id, queue in queues.items()
+        ]
+        heapq.heapify(heap)
+
+        released = []
+        while heap:
+            finish_tag, user_id = heapq.heappop(heap)
+            _cost, _seq, job = queues[user_id].pop(0)
+            released.append((finish_tag, user_id, job))
+            if queues[user_id]:
+                next_tag = self.tag(user_id, finish_tag, queues[user_id][0][2])
+                heapq.heappush(heap, (next_tag, user_id))
+        return released
+
+    def submit(self, job):
+        '''Hold the job until the printers are free enough.'''
+        with self.lock:
+            entry = (job_cost(job), next(self.sequence), job)
+            self.queues.setdefault(job.user_id, []).append(entry)
+        self.release()
+
+    def remove(self, job):
+        '''Stop holding the job, e.g. because it was cancelled.'''
+        with self.lock:
+            queue = self.queues.get(job.user_id, [])
+            self.queues[job.user_id] = [entry for entry in queue if entry[2] is not job]
+        self.update_positions()
+
+    def release(self):
+        '''Send the jobs to CUPS while the printers' queues are short enough.'''
+        with self.lock:
+            capacity = self.threshold * len(self.group.names)
+            pending = sum(self.group.pending_pages().values()) + self.starting_pages
+
+            for finish_tag, user_id, job in self.order():
+                if pending >= capacity:
+                    break
+
+                self.queues[user_id] = [entry for entry in self.queues[user_id]
+                                        if entry[2] is not job]
+                self.virtual_time = finish_tag
+                self.finish_tags[user_id] = finish_tag
+                cost = job_cost(job)
+                self.starting_pages += cost
+                pending += cost
+                self.executor.submit(self.start, job, cost)
+
+        self.update_positions()
+
+    def start(self, job, cost: int):
+        '''Prepare and send a released job to CUPS, in a worker.'''
+        try:
+            job.start()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Could not submit job {}', job.id)
+            job.fail('Could not send the document to the printer, please try again.')
+        finally:
+            with self.lock:
+                self.starting_pages -= cost
+
+    def starting(self) -> bool:
+        '''Check whether any released jobs are still being sent to CUPS.'''
+        with self.lock:
+            return self.starting_pages > 0
+
+    def held(self) -> int:
+        '''Return the amount of jobs being held.'''
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def update_positions(self):
+        '''Let the held jobs know of their new place in line.'''
+        with self.lock:
+            jobs = [job for _tag, _user_id, job in self.order()]
+        for position, job in enumerate(jobs, start=1):
+            job.set_queue_position(position)
+
+
+scheduler = FairScheduler(printers,
+                          threshold=int(os.getenv('QUEUE_THRESHOLD_PAGES', '10')),
+                          workers=int(os.getenv('SCHEDULER_WORKERS', '2')))
+gauge('printer_pending_jobs',
+      'Print jobs held by the bot until the printers are free').set_function(scheduler.held)
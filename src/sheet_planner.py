@@ -0,0 +1,41 @@
+from PyPDF4.pdf import PageObject
+
+
+def is_landscape(page: PageObject) -> bool:
+    '''Check whether the page is wider than it is tall, as it is displayed.'''
+    rotation = (page.get('/Rotate') or 0) % 360
+    width = page.mediaBox.getWidth()
+    height = page.mediaBox.getHeight()
+    return (width > height) == (rotation in (0, 180))
+
+
+class SheetPlanner:
+    '''Decides how to turn the pages of a document with mixed orientation
+       so that every sheet comes out the same way up.
+
+       The duplex edge is chosen once for the whole job from the orientation of most pages.
+       The pages of the other orientation are turned to match it, clockwise on the front
+       of a sheet and counterclockwise on the back, so that the tops of both sides
+       end up on the same edge of the paper once it is flipped.'''
+    __slots__ = ('portrait', 'duplex', 'per_page')
+
+    def __init__(self, portrait: bool, duplex: bool, per_page: int):
+        self.portrait = portrait
+        self.duplex = duplex
+        self.per_page = per_page
+
+    def rotation(self, page: PageObject, position: int) -> int:
+        '''Return the degrees to turn the page clockwise by,
+           given its position among the pages to print, counted from the start of a sheet.'''
+        if is_landscape(page) != self.portrait:
+            return 0
+
+        side = position // self.per_page
+        return 270 if self.duplex and side % 2 else 90
+
+    def orient(self, page: PageObject, position: int) -> PageObject:
+        '''Turn the page in place if it doesn't match the orientation of the job.'''
+        rotation = self.rotation(page, position)
+        if rotation:
+            page.rotateClockwise(rotation)
+        return page
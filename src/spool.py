@@ -0,0 +1,49 @@
+import io
+import os
+from uuid import uuid4
+
+from .metrics import gauge
+
+SPOOL_DIR = os.getenv('SPOOL_DIR', 'spool')
+
+
+def spool_size() -> int:
+    '''Return the total size of the files in the spool, in bytes.'''
+    try:
+        with os.scandir(SPOOL_DIR) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+gauge('printer_spool_bytes', 'Total size of the files in the spool').set_function(spool_size)
+
+
+class SpoolFile(io.BufferedRandom):
+    '''A file in the spool directory that outlives restarts of the bot.
+
+       Unlike a `NamedTemporaryFile`, closing the file keeps it on disk,
+       it is only removed with `delete`.'''
+
+    def __init__(self, path: str, mode: str = 'r+b'):
+        super().__init__(io.FileIO(path, mode.replace('b', '')))
+        self.original_name = None
+
+    @classmethod
+    def create(cls) -> 'SpoolFile':
+        '''Create a new empty file in the spool.'''
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        return cls(os.path.join(SPOOL_DIR, uuid4().hex), 'w+b')
+
+    def delete(self):
+        '''Close the file and remove it from the spool.'''
+        self.close()
+        self.remove(self.name)
+
+    @staticmethod
+    def remove(path: str):
+        '''Remove a file from the spool, if it's still there.'''
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
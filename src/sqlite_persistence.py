@@ -0,0 +1,189 @@
+import json
+import pickle
+import sqlite3
+import time
+from collections import defaultdict
+from hashlib import blake2b
+from threading import RLock
+from typing import DefaultDict, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+'''
+
+
+def digest(blob: bytes) -> bytes:
+    '''Return a short fingerprint of the serialized data.'''
+    return blake2b(blob, digest_size=16).digest()
+
+
+class SQLitePersistence(BasePersistence):
+    '''Persist the bot's data in an SQLite database in WAL mode.
+
+       Unlike `PicklePersistence`, only the rows that actually changed are written.
+       Writes are committed in batches, either every `commit_interval` seconds
+       or every `batch_size` changed rows, whichever comes first, and on flush.
+       `commit_pending` should be called every `commit_interval` seconds too,
+       so that the last writes of a burst are committed while the bot is idle.'''
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 filename: str,
+                 store_user_data: bool = True,
+                 store_chat_data: bool = True,
+                 store_bot_data: bool = True,
+                 *,
+                 commit_interval: float = 1.0,
+                 batch_size: int = 100):
+        super().__init__(store_user_data=store_user_data,
+                         store_chat_data=store_chat_data,
+                         store_bot_data=store_bot_data)
+        self.filename = filename
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.lock = RLock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+        # Digests of the last written rows, to skip writing the unchanged ones
+        self.written: Dict[tuple, bytes] = {}
+        self.uncommitted = 0
+        self.committed_at = time.monotonic()
+
+        self.user_data: Optional[DefaultDict[int, dict]] = None
+        self.chat_data: Optional[DefaultDict[int, dict]] = None
+        self.bot_data: Optional[dict] = None
+        self.conversations: Dict[str, dict] = {}
+
+    def load_table(self, table: str) -> DefaultDict[int, dict]:
+        '''Read all the rows of a user/chat data table.'''
+        data = defaultdict(dict)
+        with self.lock:
+            for row_id, blob in self.connection.execute(f'SELECT id, data FROM {table}'):
+                data[row_id] = pickle.loads(blob)
+                self.written[(table, row_id)] = digest(blob)
+        return data
+
+    def write(self, row_key: tuple, query: str, params: tuple, blob: bytes):
+        '''Write a row unless it's identical to what was written before.'''
+        blob_digest = digest(blob)
+        with self.lock:
+            if self.written.get(row_key) == blob_digest:
+                return
+            self.connection.execute(query, params)
+            self.written[row_key] = blob_digest
+            self.uncommitted += 1
+
+            if (self.uncommitted >= self.batch_size
+                    or time.monotonic() - self.committed_at >= self.commit_interval):
+                self.commit()
+
+    def commit(self):
+        '''Commit the pending writes.'''
+        with self.lock:
+            self.connection.commit()
+            self.uncommitted = 0
+            self.committed_at = time.monotonic()
+
+    def commit_pending(self):
+        '''Commit the writes that are still waiting for the batch to fill up.'''
+        with self.lock:
+            if self.uncommitted:
+                self.commit()
+
+    def get_user_data(self) -> DefaultDict[int, dict]:
+        if self.user_data is None:
+            self.user_data = self.load_table('user_data')
+        return self.user_data
+
+    def get_chat_data(self) -> DefaultDict[int, dict]:
+        if self.chat_data is None:
+            self.chat_data = self.load_table('chat_data')
+        return self.chat_data
+
+    def get_bot_data(self) -> dict:
+        if self.bot_data is None:
+            with self.lock:
+                row = self.connection.execute('SELECT data FROM bot_data WHERE id = 0').fetchone()
+            self.bot_data = pickle.loads(row[0]) if row else {}
+            if row:
+                self.written[('bot_data', 0)] = digest(row[0])
+        return self.bot_data
+
+    def get_conversations(self, name: str) -> dict:
+        if name not in self.conversations:
+            with self.lock:
+                rows = self.connection.execute(
+                    'SELECT key, state FROM conversations WHERE name = ?', (name,)
+                ).fetchall()
+            conversations = {}
+            for key, blob in rows:
+                conversations[tuple(json.loads(key))] = pickle.loads(blob)
+                self.written[('conversations', name, key)] = digest(blob)
+            self.conversations[name] = conversations
+        return self.conversations[name]
+
+    def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]):
+        self.conversations.setdefault(name, {})[key] = new_state
+        json_key = json.dumps(key)
+        blob = pickle.dumps(new_state)
+        self.write(
+            ('conversations', name, json_key),
+            'INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)',
+            (name, json_key, blob),
+            blob,
+        )
+
+    def update_user_data(self, user_id: int, data: dict):
+        self.get_user_data()[user_id] = data
+        blob = pickle.dumps(data)
+        self.write(('user_data', user_id),
+                   'INSERT OR REPLACE INTO user_data (id, data) VALUES (?, ?)',
+                   (user_id, blob),
+                   blob)
+
+    def update_chat_data(self, chat_id: int, data: dict):
+        self.get_chat_data()[chat_id] = data
+        blob = pickle.dumps(data)
+        self.write(('chat_data', chat_id),
+                   'INSERT OR REPLACE INTO chat_data (id, data) VALUES (?, ?)',
+                   (chat_id, blob),
+                   blob)
+
+    def update_bot_data(self, data: dict):
+        self.bot_data = data
+        blob = pickle.dumps(data)
+        self.write(('bot_data', 0),
+                   'INSERT OR REPLACE INTO bot_data (id, data) VALUES (0, ?)',
+                   (blob,),
+                   blob)
+
+    def flush(self):
+        self.commit()
+        with self.lock:
+            self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def import_pickle(self, filename: str):
+        '''Copy the data saved by a `PicklePersistence` into the database.'''
+        with open(filename, 'rb') as file:
+            data = pickle.load(file)
+
+        for user_id, user_data in data.get('user_data', {}).items():
+            self.update_user_data(user_id, user_data)
+        for chat_id, chat_data in data.get('chat_data', {}).items():
+            self.update_chat_data(chat_id, chat_data)
+        for name, conversations in (data.get('conversations') or {}).items():
+            for key, state in conversations.items():
+                self.update_conversation(name, key, state)
+        self.commit()
@@ -0,0 +1,124 @@
+import os
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from threading import Lock
+from typing import List, Tuple
+
+from PIL import Image, ImageDraw
+
+from .number_up_layout import Layout
+
+SHEET_WIDTH = 800
+JPEG_QUALITY = 70
+A4_RATIO = 2 ** 0.5
+
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('THUMBNAIL_WORKERS', '2')),
+                              thread_name_prefix='thumbnails')
+
+
+class ThumbnailCache:
+    '''A bounded LRU cache of rendered page thumbnails, compressed as JPEG.'''
+
+    def __init__(self, max_entries: int = 500):
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[Tuple[str, int, int], bytes]' = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: Tuple[str, int, int]) -> bytes:
+        '''Return the cached thumbnail or None.'''
+        with self.lock:
+            thumbnail = self.entries.get(key)
+            if thumbnail is not None:
+                self.entries.move_to_end(key)
+            return thumbnail
+
+    def put(self, key: Tuple[str, int, int], thumbnail: bytes):
+        '''Cache a thumbnail, evicting the least recently used ones.'''
+        with self.lock:
+            self.entries[key] = thumbnail
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+cache = ThumbnailCache(int(os.getenv('THUMBNAIL_CACHE_SIZE', '500')))
+
+
+def to_jpeg(image: Image.Image) -> bytes:
+    '''Compress the image for sending.'''
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def render_page(path: str, content_hash: str, page_idx: int, width: int) -> bytes:
+    '''Render a page of the PDF to a JPEG thumbnail that is `width` pixels wide.'''
+    key = (content_hash, page_idx, width)
+    thumbnail = cache.get(key)
+    if thumbnail is not None:
+        return thumbnail
+
+    with TemporaryDirectory() as directory:
+        output_root = os.path.join(directory, 'page')
+        subprocess.run(['pdftoppm',
+                        '-f', str(page_idx + 1),
+                        '-l', str(page_idx + 1),
+                        '-scale-to-x', str(width),
+                        '-scale-to-y', '-1',
+                        '-singlefile',
+                        '-jpeg',
+                        path,
+                        output_root],
+                       capture_output=True,
+                       timeout=30,
+                       check=True)
+        with open(output_root + '.jpg', 'rb') as file:
+            thumbnail = file.read()
+
+    cache.put(key, thumbnail)
+    return thumbnail
+
+
+def compose_sheet(thumbnails: List[bytes], layout: Layout) -> bytes:
+    '''Lay out the page thumbnails on a physical sheet the way N-up printing does.'''
+    if layout.is_portrait:
+        columns, rows = layout.x_pages, layout.y_pages
+        size = (SHEET_WIDTH, round(SHEET_WIDTH * A4_RATIO))
+    else:
+        columns, rows = layout.y_pages, layout.x_pages
+        size = (SHEET_WIDTH, round(SHEET_WIDTH / A4_RATIO))
+
+    sheet = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(sheet)
+    cell_width, cell_height = size[0] // columns, size[1] // rows
+    for idx, thumbnail in enumerate(thumbnails):
+        image = Image.open(BytesIO(thumbnail))
+        image.thumbnail((cell_width - 8, cell_height - 8))
+        left = (idx % columns) * cell_width + (cell_width - image.width) // 2
+        top = (idx // columns) * cell_height + (cell_height - image.height) // 2
+        sheet.paste(image, (left, top))
+        draw.rectangle((left, top, left + image.width - 1, top + image.height - 1), outline='grey')
+
+    return to_jpeg(sheet)
+
+
+def render_sheets(path: str,
+                  content_hash: str,
+                  sheets: List[List[int]],
+                  layout: Layout) -> List[bytes]:
+    '''Render the sheets (lists of page indices) as JPEG images of how they will be printed.'''
+    columns = layout.x_pages if layout.is_portrait else layout.y_pages
+    width = SHEET_WIDTH // columns
+    pages = [page_idx for sheet in sheets for page_idx in sheet]
+    thumbnails = dict(zip(pages, executor.map(
+        lambda page_idx: render_page(path, content_hash, page_idx, width),
+        pages,
+    )))
+
+    if layout.x_pages * layout.y_pages == 1:
+        return [thumbnails[sheet[0]] for sheet in sheets]
+    return [compose_sheet([thumbnails[page_idx] for page_idx in sheet], layout)
+            for sheet in sheets]
@@ -0,0 +1,75 @@
+import json
+import os
+import re
+import secrets
+import time
+from hashlib import blake2b
+from threading import Lock
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+RECORD_TRACE = os.getenv('RECORD_TRACE')
+# Personal details that are dropped from the recorded updates
+DROPPED_FIELDS = {'last_name', 'username', 'language_code', 'title', 'url',
+                  'photo', 'thumb', 'contact', 'location', 'forward_from', 'forward_from_chat',
+                  'forward_sender_name'}
+ID_FIELDS = {'id', 'chat_id', 'user_id'}
+OPAQUE_ID_FIELDS = {'file_id', 'file_unique_id', 'media_group_id', 'chat_instance'}
+letter_ptn = re.compile(r'[^\W\d_]')
+command_ptn = re.compile(r'^(/\w+)')
+
+
+class TraceRecorder:
+    '''Writes the incoming updates with their timing to a JSON Lines file, anonymized:
+       user and chat IDs are replaced with pseudonyms, names are dropped,
+       letters in texts and captions are masked and files are only described
+       by their type and size, so that a trace can be shared and replayed.'''
+
+    def __init__(self, filename: str):
+        # pylint: disable=consider-using-with
+        self.file = open(filename, 'a', buffering=1, encoding='utf-8')
+        self.key = secrets.token_bytes(16)
+        self.started_at: Optional[float] = None
+        self.lock = Lock()
+
+    def pseudonym(self, value) -> int:
+        '''Return a stable stand-in for an identifier.'''
+        digest = blake2b(str(value).encode(), key=self.key, digest_size=6).digest()
+        return int.from_bytes(digest, 'big')
+
+    def anonymize(self, value, key: str = None):  # pylint: disable=too-many-return-statements
+        '''Return a copy of part of an update without personal details.'''
+        if isinstance(value, dict):
+            return {field: self.anonymize(item, field)
+                    for field, item in value.items() if field not in DROPPED_FIELDS}
+        if isinstance(value, list):
+            return [self.anonymize(item, key) for item in value]
+        if key in ID_FIELDS and isinstance(value, int):
+            return self.pseudonym(value)
+        if key in OPAQUE_ID_FIELDS:
+            return f'{key}-{self.pseudonym(value)}'
+        if key == 'first_name':
+            # Required in users, so it can't be dropped
+            return 'User'
+        if key == 'file_name':
+            return 'document' + os.path.splitext(value)[1].lower()
+        if key in ('text', 'caption'):
+            command = command_ptn.match(value)
+            if command is not None:
+                # Command arguments may be secret, like the authentication token
+                return command.group(1)
+            # Keep the digits and punctuation, which make up page ranges and amounts
+            return letter_ptn.sub('x', value)
+        return value
+
+    def record(self, update: Update, _context: CallbackContext):
+        '''Append the update to the trace.'''
+        now = time.monotonic()
+        line = {'update': self.anonymize(update.to_dict())}
+        with self.lock:
+            if self.started_at is None:
+                self.started_at = now
+            line['time'] = round(now - self.started_at, 3)
+            self.file.write(json.dumps(line, separators=(',', ':')) + '\n')
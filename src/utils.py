@@ -1,12 +1,13 @@
-import subprocess
-from io import BytesIO
+import json
 from tempfile import NamedTemporaryFile
-from typing import List, Tuple, BinaryIO
+from typing import List, Optional, Tuple, BinaryIO, Iterable
 
 from PyPDF4 import PdfFileReader, PdfFileWriter
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ReplyMarkup
 
-from .page_selection import PageSelection
+from .converters import convert
+from .sheet_planner import SheetPlanner, is_landscape
+from .work import WorkHandle
 
 
 def get_inline_keyboard(layout: List[List[Tuple[str, str]]]) -> InlineKeyboardMarkup:
@@ -21,6 +22,46 @@ def get_inline_keyboard(layout: List[List[Tuple[str, str]]]) -> InlineKeyboardMa
     ])
 
 
+class KeyboardTemplate:
+    '''An inline keyboard that is serialized once and bound to a job ID when it is shown.
+
+       The layout is given like for `get_inline_keyboard`,
+       except that the callback data leaves out the `<job ID>:` prefix.'''
+    __slots__ = ('parts',)
+    # Stands for the job ID in the serialized keyboard, it never appears in button texts
+    PLACEHOLDER = '\0'
+
+    def __init__(self, layout: List[List[Tuple[str, str]]]):
+        markup = get_inline_keyboard([
+            row and [(name, f'{self.PLACEHOLDER}:{action}') for (name, action) in row]
+            for row in layout
+        ])
+        self.parts = tuple(markup.to_json().split(json.dumps(self.PLACEHOLDER)[1:-1]))
+
+    def bind(self, id: str) -> 'BoundKeyboard':
+        '''Return the keyboard with the callback data of the given job.'''
+        return BoundKeyboard(self, id)
+
+
+class BoundKeyboard(ReplyMarkup):
+    '''An inline keyboard made from a template, which only joins its parts when it is sent.'''
+
+    def __init__(self, template: KeyboardTemplate, job_id: str):
+        self.template = template
+        self.job_id = job_id
+
+    def to_json(self) -> str:
+        return self.job_id.join(self.template.parts)
+
+    def to_dict(self) -> dict:
+        return json.loads(self.to_json())
+
+
+def bind_keyboard(template: Optional[KeyboardTemplate], id: str) -> Optional[BoundKeyboard]:
+    '''Bind the template to the job, if there is a keyboard to show.'''
+    return template and template.bind(id)
+
+
 # pylint: disable=invalid-name
 
 def s(amount: int, plural_ending: str = 's', singular_ending: str = '') -> str:
@@ -32,51 +73,57 @@ def s(amount: int, plural_ending: str = 's', singular_ending: str = '') -> str:
 # pylint: enable=invalid-name
 
 
-def convert_to_pdf(file: NamedTemporaryFile, mime: str) -> bool:
+def convert_to_pdf(file: NamedTemporaryFile, mime: str, handle: WorkHandle = None) -> bool:
     '''Convert a file to PDF if necessary.
        Return whether the conversion took place.'''
     if mime == 'application/pdf':
         return False
 
-    unoconv = subprocess.run(['unoconv', '--stdout', '-f', 'pdf', file.name],
-                             text=False,
-                             capture_output=True,
-                             timeout=60,
-                             check=True)
+    converted = convert(file, mime, handle)
+    if handle is not None:
+        handle.raise_if_cancelled()
     file.seek(0)
-    file.write(unoconv.stdout)
+    file.write(converted)
     file.truncate()
 
     return True
 
 
-def is_portrait(reader: PdfFileReader) -> bool:
-    '''Based on the existing PDF reader, determine the orientation of the document.'''
-    landscape_pages = 0
-    portrait_pages = 0
-    for page in reader.pages:
-        rotation = page.get('/Rotate')
-        width = page.mediaBox.getWidth()
-        height = page.mediaBox.getHeight()
-        if (width > height) == (rotation in (0, 180, None)):
-            landscape_pages += 1
-        else:
-            portrait_pages += 1
+def count_orientations(reader: PdfFileReader) -> Tuple[int, int]:
+    '''Based on the existing PDF reader, count the portrait and the landscape pages.'''
+    landscape_pages = sum(1 for page in reader.pages if is_landscape(page))
+    return reader.numPages - landscape_pages, landscape_pages
+
+
+def write_pages(reader: PdfFileReader,
+                page_indices: Iterable[int],
+                output: BinaryIO,
+                handle: WorkHandle = None,
+                planner: SheetPlanner = None):
+    '''Write a PDF with only the given pages of the existing PDF reader,
+       turned by the planner if there is one. The pages should start on a new sheet.
+       If the reader's file is wrapped by the handle too, the writing stops mid-way
+       once the handle is cancelled.'''
+    writer = PdfFileWriter()
+
+    for position, page_idx in enumerate(page_indices):
+        if handle is not None:
+            handle.raise_if_cancelled()
+        page = reader.getPage(page_idx)
+        if planner is not None:
+            planner.orient(page, position)
+        writer.addPage(page)
 
-    return portrait_pages > landscape_pages
+    writer.write(handle.wrap(output) if handle is not None else output)
 
 
-def apply_page_selection(pdf: BinaryIO, pages: PageSelection):
-    '''Exclude the pages from the PDF that weren't selected.'''
-    reader = PdfFileReader(pdf)
+def merge_pdfs(pdfs: List[BinaryIO], output: BinaryIO):
+    '''Write the pages of all the PDFs one after another into the output file.'''
     writer = PdfFileWriter()
 
-    for page_idx in pages:
-        writer.addPage(reader.getPage(page_idx))
+    for pdf in pdfs:
+        for page in PdfFileReader(pdf).pages:
+            writer.addPage(page)
 
-    output = BytesIO()
     writer.write(output)
-    pdf.seek(0)
-    pdf.write(output.getvalue())
-    pdf.truncate()
-    pdf.seek(0)
+    output.seek(0)
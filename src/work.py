@@ -0,0 +1,95 @@
+import subprocess
+from concurrent.futures import Future
+from threading import Lock
+from typing import BinaryIO, List, Optional, Sequence
+
+
+class Cancelled(Exception):
+    '''Raised inside the work whose handle was cancelled.'''
+
+
+class WorkHandle:
+    '''Lets the conversion and preparation of a print job be stopped from another thread.
+
+       The work checks `raise_if_cancelled` between steps, runs its subprocesses
+       with `run` so that they can be killed, and reads or writes PDFs through `wrap`
+       so that PyPDF4 stops in the middle of a document.'''
+    __slots__ = ('cancelled', 'job_id', 'futures', 'processes', 'lock')
+
+    def __init__(self):
+        self.cancelled = False
+        self.job_id: Optional[str] = None
+        self.futures: List[Future] = []
+        self.processes: List[subprocess.Popen] = []
+        self.lock = Lock()
+
+    def cancel(self):
+        '''Stop the work: kill its subprocesses and drop it from the queue if it hasn't started.'''
+        with self.lock:
+            self.cancelled = True
+            processes = list(self.processes)
+            futures = list(self.futures)
+        for process in processes:
+            process.kill()
+        for future in futures:
+            future.cancel()
+
+    def raise_if_cancelled(self):
+        '''Interrupt the work if it was cancelled.'''
+        if self.cancelled:
+            raise Cancelled()
+
+    def attach(self, future: Future):
+        '''Cancel the queued function along with the rest of the work.'''
+        with self.lock:
+            self.futures.append(future)
+        if self.cancelled:
+            future.cancel()
+
+    def run(self, args: Sequence[str], timeout: float) -> bytes:
+        '''Run a command like `subprocess.run(check=True)` would and return its output,
+           killing the command if the work is cancelled.'''
+        with self.lock:
+            self.raise_if_cancelled()
+            # pylint: disable=consider-using-with
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.processes.append(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            with self.lock:
+                self.processes.remove(process)
+
+        self.raise_if_cancelled()
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+        return stdout
+
+    def wrap(self, file: BinaryIO) -> BinaryIO:
+        '''Return the file with reads and writes that fail once the work is cancelled.'''
+        return CancellableFile(file, self)
+
+
+class CancellableFile:
+    '''A file whose reads and writes raise `Cancelled` once its work is cancelled.'''
+
+    def __init__(self, file: BinaryIO, handle: WorkHandle):
+        self.file = file
+        self.handle = handle
+
+    def read(self, *args) -> bytes:
+        '''Read from the file unless the work was cancelled.'''
+        self.handle.raise_if_cancelled()
+        return self.file.read(*args)
+
+    def write(self, data: bytes) -> int:
+        '''Write to the file unless the work was cancelled.'''
+        self.handle.raise_if_cancelled()
+        return self.file.write(data)
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.file, attribute)